@@ -1,13 +1,22 @@
 from shiny import App
 from src.controller import AppController
+from src.metrics import with_metrics
+from src.api import with_search_api
 
 
 def create_app():
     controller = AppController()
     app = App(ui=controller.ui, server=controller.server)
-    return app
-
-app = create_app()
+    # Prometheus scrapes /metrics and /api/search answers object searches;
+    # everything else goes to the Shiny app.
+    return with_metrics(with_search_api(app))
 
 if __name__ == "__main__":
-    app.run(debug=True, port=8000)
+    from shiny import run_app
+    # One worker process only: it keeps users.duckdb open for writing,
+    # which DuckDB allows a single process at a time.
+    run_app("app:app", port=8000)
+elif __name__ != "__mp_main__":
+    # Spawned ingest workers re-run this script as __mp_main__; they must
+    # not build the app, which opens the database this process holds.
+    app = create_app()
@@ -0,0 +1,56 @@
+"""
+Times marker and popup generation for synthetic object sets:
+
+    python benchmarks/markers.py
+    python benchmarks/markers.py --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from src.mapmanager import MapManager, render_popups
+
+
+def synthetic_objects(n, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = [f"Q{i + 1}" for i in range(n)]
+    return pd.DataFrame({
+        "id": np.arange(n),
+        "wikidata_id": ids,
+        "label": [f"Object {i}" for i in ids],
+        "alt_label": [f"Oggetto {i}" for i in ids],
+        "description": "Synthetic heritage object",
+        "date": "1500-01-01T00:00:00Z",
+        "latitude": 44.4183598 + rng.uniform(-0.05, 0.05, n),
+        "longitude": 12.2035294 + rng.uniform(-0.05, 0.05, n),
+        "property": "Synthetic owner",
+        "official_site": [f"https://example.org/{i}" for i in ids],
+        "viaf": rng.integers(100000, 999999, n).astype(str),
+    })
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'objects':>10} {'popups (s)':>12} {'markers (s)':>12} {'per marker (us)':>16}")
+    for n in args.sizes:
+        data = synthetic_objects(n)
+        _, popup_seconds = timed(render_popups, data)
+        _, marker_seconds = timed(MapManager().generate_markers, data)
+        print(f"{n:>10} {popup_seconds:>12.3f} {marker_seconds:>12.3f} {marker_seconds / n * 1e6:>16.1f}")
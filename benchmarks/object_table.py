@@ -0,0 +1,62 @@
+"""
+Times the object grid's page query against loading the whole objects
+table, for growing synthetic tables in a throwaway database:
+
+    python benchmarks/object_table.py
+    python benchmarks/object_table.py --sizes 10000 100000 500000 --page-size 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from markers import synthetic_objects
+from src.dbfunctions import connection, get_objects, get_objects_page
+
+
+def best_of(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def fill(db_path, n):
+    data = synthetic_objects(n)
+    with connection(db_path) as conn:
+        conn.register("object_data", data)
+        conn.execute("INSERT INTO objects SELECT * FROM object_data")
+        conn.unregister("object_data")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 500000])
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'objects':>10} {'all rows':>10} {'first':>8} {'middle':>8} {'label desc':>11} {'filtered':>9}   (ms)")
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "objects.duckdb")
+            fill(db_path, n)
+            limit = args.page_size
+            # The keyset cursor of a page in the middle of the table.
+            middle = (n // 2, n // 2)
+            timings = [
+                best_of(lambda: get_objects(db_path), args.repeat),
+                best_of(lambda: get_objects_page(limit=limit, db_path=db_path), args.repeat),
+                best_of(lambda: get_objects_page(after=middle, limit=limit, db_path=db_path), args.repeat),
+                best_of(lambda: get_objects_page("label", True, limit=limit, db_path=db_path), args.repeat),
+                best_of(lambda: get_objects_page(filters={"label": "Q12"}, limit=limit, db_path=db_path), args.repeat),
+            ]
+            print(f"{n:>10} " + " ".join(f"{seconds * 1000:>{width}.1f}" for seconds, width in zip(timings, (10, 8, 8, 11, 9))))
@@ -0,0 +1,228 @@
+"""
+Times the ingest -> query -> render pipeline on synthetic data, fully
+offline: N objects scattered around the configured map centre are imported
+through the SPARQL stub in tools/, and M polygons with K vertices each are
+written as an EPSG:32632 shapefile and ingested like an upload. Every stage
+runs against a throwaway database.
+
+    python benchmarks/pipeline.py
+    python benchmarks/pipeline.py --objects 10000 --polygons 2000 --vertices 128
+    python benchmarks/pipeline.py --save-baseline
+    python benchmarks/pipeline.py --baseline benchmarks/pipeline_baseline.json --time-threshold 0.3
+
+Results are written as JSON (--output). When a baseline with the same sizes
+exists, stages slower or hungrier than it by more than the thresholds are
+reported and the exit status is 1. Timings only compare on one machine, so
+results and baselines are kept out of git: save a baseline with
+--save-baseline where the comparisons will run.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import shapely
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+os.chdir(ROOT)
+
+from sparql_stub import start_stub_server, synthetic_entity
+from src.config import config
+from src.layercache import layer_cache
+from src.sparqlcache import sparql_cache
+from src import dbfunctions
+from src.analytics import risk_analytics
+from src.mapmanager import MapManager, render_popups
+from src.plotmanager import PlotManager
+
+
+def synthetic_polygons(m, k, seed=0, spread=5000.0, radius=(50.0, 400.0)):
+    # M jittered K-gons in EPSG:32632 scattered over a square of
+    # 2 * spread metres around the configured map centre.
+    import geopandas as gpd
+    from pyproj import Transformer
+    rng = np.random.default_rng(seed)
+    to_utm = Transformer.from_crs("EPSG:4326", "EPSG:32632", always_xy=True)
+    x0, y0 = to_utm.transform(config["map"]["longitude"], config["map"]["latitude"])
+
+    centres = np.column_stack([x0 + rng.uniform(-spread, spread, m), y0 + rng.uniform(-spread, spread, m)])
+    angles = np.sort(rng.uniform(0, 2 * np.pi, (m, k)), axis=1)
+    radii = rng.uniform(*radius, (m, 1)) * rng.uniform(0.7, 1.0, (m, k))
+    rings = np.stack([centres[:, :1] + radii * np.cos(angles), centres[:, 1:] + radii * np.sin(angles)], axis=-1)
+    rings = np.concatenate([rings, rings[:, :1]], axis=1)
+    headings = dbfunctions.get_risk_headings()
+    return gpd.GeoDataFrame({
+        "name": rng.choice(headings, m),
+        "code": np.arange(m),
+    }, geometry=shapely.polygons(rings), crs="EPSG:32632")
+
+
+def synthetic_entities(n, spread=0.05):
+    latitude, longitude = config["map"]["latitude"], config["map"]["longitude"]
+    return {f"Q{i + 1}": synthetic_entity(f"Q{i + 1}", latitude, longitude, spread) for i in range(n)}
+
+
+def synthetic_scores(entity_ids, seed=0):
+    rng = np.random.default_rng(seed)
+    headings = dbfunctions.get_risk_headings()
+    return pd.DataFrame({
+        "wikidata_id": np.repeat(entity_ids, len(headings)),
+        "heading": headings * len(entity_ids),
+        "value": rng.integers(0, 10, len(entity_ids) * len(headings)),
+    })
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(function, repeat=1, trace=True):
+    # Repeatable stages are timed untraced, best of `repeat`, and then run
+    # once more under tracemalloc for their heap peak. Other stages run
+    # exactly once, so with tracing on their time includes its overhead.
+    seconds = None
+    result = None
+    if repeat > 1:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+            seconds = elapsed if seconds is None else min(seconds, elapsed)
+    peak = None
+    if seconds is None or trace:
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+        if seconds is None:
+            seconds = elapsed
+    return result, {"seconds": seconds, "peak_mb": peak, "rss_mb": peak_rss_mb()}
+
+
+def run(objects, polygons, vertices, repeat=3, trace=True):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.duckdb")
+        layer_path = os.path.join(tmp, "synthetic.shp")
+        # SPARQL responses are cached next to the benchmark data, never in
+        # the app database.
+        sparql_cache.db_path = db_path
+        sparql_cache.mode = "online"
+        server, endpoint_url = start_stub_server(synthetic_entities(objects))
+        synthetic_polygons(polygons, vertices).to_file(layer_path)
+        entity_ids = [f"Q{i + 1}" for i in range(objects)]
+
+        def step(name, function, repeatable):
+            result, stats = measure(function, repeat if repeatable else 1, trace)
+            results[name] = stats
+            print(f"{name:<16} {stats['seconds']:>10.3f} "
+                  f"{stats['peak_mb'] if stats['peak_mb'] is not None else float('nan'):>12.1f} {stats['rss_mb']:>10.1f}")
+            return result
+
+        print(f"{'stage':<16} {'seconds':>10} {'heap peak MB':>12} {'rss MB':>10}")
+        step("ingest_layer", lambda: dbfunctions.add_geodataframe(layer_path, db_path), False)
+        table_name = dbfunctions.layer_name(layer_path)
+        layer_cache.invalidate((db_path, table_name))
+        step("layer_cold", lambda: dbfunctions.get_geospatial_data(table_name, db_path, parsed=True), False)
+        step("layer_warm", lambda: dbfunctions.get_geospatial_data(table_name, db_path, parsed=True), True)
+        half = 0.01
+        bbox = (config["map"]["longitude"] - half, config["map"]["latitude"] - half,
+                config["map"]["longitude"] + half, config["map"]["latitude"] + half)
+        step("layer_bbox", lambda: dbfunctions.get_geospatial_data_in_bbox(table_name, bbox, config["map"]["zoom"], db_path, parsed=True), True)
+        step("import_objects", lambda: dbfunctions.add_objects(entity_ids, db_path, endpoint_url=endpoint_url), False)
+        step("set_risk_scores", lambda: dbfunctions.set_risk_scores(synthetic_scores(entity_ids), db_path), False)
+        objects = step("get_objects", lambda: dbfunctions.get_objects(db_path), True)
+        step("popups", lambda: render_popups(objects), True)
+        step("markers", lambda: MapManager().generate_markers(objects), True)
+        map_manager = MapManager(layer_loader=lambda table, bbox=None, zoom=None: dbfunctions.get_geospatial_data(
+            table, db_path, parsed=True, bbox=bbox, zoom=zoom))
+        map_manager.create_map()
+        map_manager.update_map([table_name])
+        points = shapely.points(objects["longitude"].astype(float), objects["latitude"].astype(float))
+        step("is_in_geometry", lambda: [map_manager.is_in_geometry(point) for point in points], True)
+        step("spatial_join", lambda: risk_analytics.compute_exposure([table_name], db_path), True)
+        plot_manager = PlotManager()
+        step("plot", lambda: plot_manager.render(risk_analytics.compute_plot_data([table_name], db_path)), True)
+
+        server.shutdown()
+        dbfunctions.get_connection_manager(db_path).close()
+    return results
+
+
+def compare(results, baseline, time_threshold, memory_threshold, min_seconds):
+    # Returns one message per stage that regressed beyond the thresholds.
+    # Stages faster than min_seconds are compared against min_seconds, so
+    # timer noise on tiny stages is not reported.
+    regressions = []
+    for name, stats in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        allowed = max(reference["seconds"], min_seconds) * (1 + time_threshold)
+        if stats["seconds"] > allowed:
+            regressions.append(f"{name}: {stats['seconds']:.3f}s vs baseline {reference['seconds']:.3f}s")
+        if stats.get("peak_mb") is not None and reference.get("peak_mb") is not None:
+            if stats["peak_mb"] > max(reference["peak_mb"], 1.0) * (1 + memory_threshold):
+                regressions.append(f"{name}: {stats['peak_mb']:.1f} MB vs baseline {reference['peak_mb']:.1f} MB")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--objects", type=int, default=2000, help="N synthetic objects")
+    parser.add_argument("--polygons", type=int, default=1000, help="M synthetic polygons")
+    parser.add_argument("--vertices", type=int, default=64, help="K vertices per polygon")
+    parser.add_argument("--repeat", type=int, default=3, help="best-of runs for read-only stages")
+    parser.add_argument("--no-trace", action="store_true", help="skip heap tracing")
+    parser.add_argument("--output", default="benchmarks/pipeline_results.json")
+    parser.add_argument("--baseline", default="benchmarks/pipeline_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--time-threshold", type=float, default=0.25, help="allowed slowdown, as a fraction")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="allowed heap growth, as a fraction")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="noise floor for timings")
+    args = parser.parse_args()
+
+    sizes = {"objects": args.objects, "polygons": args.polygons, "vertices": args.vertices}
+    stages = run(args.objects, args.polygons, args.vertices, args.repeat, not args.no_trace)
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sizes": sizes,
+        "traced": not args.no_trace,
+        "stages": stages,
+    }
+    with open(args.output, "w") as fp:
+        json.dump(report, fp, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as fp:
+            json.dump(report, fp, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        if baseline["sizes"] != sizes or baseline.get("traced") != report["traced"]:
+            print(f"Baseline {args.baseline} was recorded with different settings, not comparing.")
+        else:
+            regressions = compare(stages, baseline["stages"], args.time_threshold, args.memory_threshold, args.min_seconds)
+            for message in regressions:
+                print(f"REGRESSION {message}")
+            if regressions:
+                sys.exit(1)
+            print(f"No regressions against {args.baseline}.")
@@ -0,0 +1,91 @@
+"""
+Renders the risk plot thousands of times and samples memory along the way.
+More distinct datasets are cycled than the plot cache holds, so most
+renders miss and draw a new figure; RSS (and, with --trace, the Python
+heap) should level off once the cache is full:
+
+    python benchmarks/plot_soak.py
+    python benchmarks/plot_soak.py --renders 2000 --datasets 100 --samples 10 --trace
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from src.plotmanager import PlotManager
+
+
+def synthetic_plot_data(seed, objects=10, risks=("Earthquake", "Flood")):
+    rng = np.random.default_rng(seed)
+    names = [f"Object {seed}-{i}" for i in range(objects)]
+    return pd.DataFrame({
+        "name": np.repeat(names, len(risks)),
+        "risk": list(risks) * objects,
+        "value": rng.integers(0, 15, objects * len(risks)),
+    })
+
+
+def rss_mb():
+    # Current resident set size from /proc, falling back to the peak where
+    # /proc is not available.
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def open_figures():
+    from matplotlib import _pylab_helpers
+    return len(_pylab_helpers.Gcf.figs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", type=int, default=2000)
+    parser.add_argument("--datasets", type=int, default=100, help="distinct inputs cycled through")
+    parser.add_argument("--samples", type=int, default=10)
+    parser.add_argument("--trace", action="store_true", help="also trace Python allocations (much slower)")
+    args = parser.parse_args()
+
+    manager = PlotManager()
+    datasets = [synthetic_plot_data(seed) for seed in range(args.datasets)]
+    interval = max(args.renders // args.samples, 1)
+
+    # One warm-up render so imports and font caches are not counted as growth.
+    manager.render(datasets[0])
+    if args.trace:
+        tracemalloc.start()
+    first_rss = None
+    start = time.perf_counter()
+
+    print(f"{'renders':>8} {'rss (MB)':>10} {'traced (MB)':>12} {'cache':>6} {'hits':>6} {'misses':>7} {'figures':>8}")
+    for i in range(1, args.renders + 1):
+        manager.create_plot(datasets[i % args.datasets])
+        if i % interval == 0 or i == args.renders:
+            traced = f"{tracemalloc.get_traced_memory()[0] / 2**20:.2f}" if args.trace else "-"
+            stats = manager.get_stats()
+            # Growth is measured from the first sample, once the cache and
+            # matplotlib's own text caches have filled up.
+            first_rss = first_rss or rss_mb()
+            print(f"{i:>8} {rss_mb():>10.1f} {traced:>12} {stats['entries']:>6} "
+                  f"{stats['hits']:>6} {stats['misses']:>7} {open_figures():>8}")
+
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    stats = manager.get_stats()
+    print(f"\n{args.renders} renders in {elapsed:.1f}s "
+          f"({elapsed / max(stats['misses'], 1) * 1000:.1f} ms per drawn figure), "
+          f"RSS growth since the first sample {rss_mb() - first_rss:+.1f} MB"
+          + (f", traced peak {peak / 2**20:.2f} MB" if args.trace else ""))
+    if open_figures():
+        sys.exit("pyplot is holding on to figures")
@@ -0,0 +1,95 @@
+"""
+Times object search on synthetic objects whose text is drawn from a
+Zipf-distributed vocabulary, so a few terms are very common and most are
+rare. Objects are inserted in batches through insert_objects, which also
+measures keeping the index up to date, followed by compact_search_index as
+after an import in the app:
+
+    python benchmarks/search.py
+    python benchmarks/search.py --objects 200000 --batch 5000 --vocabulary 50000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from src.config import config
+from src.dbfunctions import compact_search_index, connection, insert_objects, search_objects
+
+
+def synthetic_words(vocabulary, seed=0):
+    rng = np.random.default_rng(seed)
+    letters = np.array(list("abcdefghilmnoprstuvz"))
+    return ["".join(rng.choice(letters, rng.integers(3, 11))) for _ in range(vocabulary)]
+
+
+def synthetic_entities(start, n, words, rng):
+    # Word ranks follow a Zipf law: rank 1 is by far the most frequent.
+    def text(length):
+        ranks = (rng.zipf(1.3, length) - 1) % len(words)
+        return " ".join(words[rank] for rank in ranks)
+
+    entities = []
+    for i in range(start, start + n):
+        entities.append((f"Q{i + 1}", {
+            "label": text(3).title(),
+            "alt_label": text(2),
+            "description": text(int(rng.integers(5, 20))),
+            "latitude": config["map"]["latitude"] + rng.uniform(-0.05, 0.05),
+            "longitude": config["map"]["longitude"] + rng.uniform(-0.05, 0.05),
+            "property": text(1),
+        }))
+    return entities
+
+
+def best_of(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--objects", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=10000, help="objects per insert_objects call")
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    words = synthetic_words(args.vocabulary)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "search.duckdb")
+        print(f"{'objects':>10} {'insert + index (s)':>19} {'compaction (s)':>15}")
+        for start in range(0, args.objects, args.batch):
+            entities = synthetic_entities(start, min(args.batch, args.objects - start), words, rng)
+            began = time.perf_counter()
+            with connection(db_path) as conn:
+                insert_objects(conn, entities)
+            inserted = time.perf_counter()
+            compacted = compact_search_index(db_path)
+            compaction = f"{time.perf_counter() - inserted:.2f}" if compacted else "-"
+            print(f"{start + len(entities):>10} {inserted - began:>19.2f} {compaction:>15}")
+
+        queries = {
+            "common term": words[0],
+            "rare term": words[-1],
+            "two terms": f"{words[5]} {words[500]}",
+            "prefix": words[50][:3],
+            "label": entities[-1][1]["label"],
+        }
+        print(f"\n{'query':<12} {'terms':<32} {'ms':>8} {'matches':>8}")
+        for name, query in queries.items():
+            seconds = best_of(lambda: search_objects(query, db_path=db_path), args.repeat)
+            matches = len(search_objects(query, db_path=db_path))
+            print(f"{name:<12} {query:<32} {seconds * 1000:>8.1f} {matches:>8}")
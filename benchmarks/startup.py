@@ -0,0 +1,80 @@
+"""
+Measures cold start of the app in fresh interpreters: the time to import
+app.py (which also opens the database) and the time from launching
+uvicorn until the first page has been served.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 5 --top 15
+
+Stop any running instance first: it holds the lock on users.duckdb.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_seconds():
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(top):
+    # Cumulative microseconds per module, from python -X importtime.
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT, capture_output=True, text=True, check=True)
+    modules = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative_us), name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def first_ui_seconds(timeout=60):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port)],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.05)
+        raise TimeoutError("The app did not answer in time.")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    args = parser.parse_args()
+
+    imports = [import_seconds() for _ in range(args.runs)]
+    first_ui = [first_ui_seconds() for _ in range(args.runs)]
+    print(f"{'':>14} {'min (s)':>8} {'median (s)':>11}")
+    print(f"{'import app':>14} {min(imports):>8.3f} {statistics.median(imports):>11.3f}")
+    print(f"{'first UI':>14} {min(first_ui):>8.3f} {statistics.median(first_ui):>11.3f}")
+    if args.top:
+        print()
+        print("Slowest imports (cumulative):")
+        for cumulative_us, name in slowest_imports(args.top):
+            print(f"{cumulative_us / 1e6:>8.3f}s {name}")
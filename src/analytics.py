@@ -0,0 +1,191 @@
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from src.dbfunctions import connection, read_layer, get_object_locations, get_table_versions
+from src.spatialindex import SpatialIndex
+from src.config import config
+
+
+class RiskAnalytics:
+    """
+    Value-box figures and plot data for a set of active layers: the object
+    at highest total risk, the risk with the highest mean, the number of
+    objects inside any active feature and the scores of the most exposed
+    objects. Results are cached per layer set and data version, so renders
+    between two writes cost one version lookup. All of them are derived
+    from one cached exposure frame, so the spatial join runs once per
+    change to the layers or objects.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_summary(self, table_names, db_path="users.duckdb"):
+        return self._cached(self.compute_summary, table_names, db_path)
+
+    def get_plot_data(self, table_names, db_path="users.duckdb"):
+        return self._cached(self.compute_plot_data, table_names, db_path)
+
+    def get_highest_risk(self, table_names, db_path="users.duckdb"):
+        return self._cached(self.compute_highest_risk, table_names, db_path)
+
+    def get_exposure(self, table_names, db_path="users.duckdb"):
+        # Shared by every caller; only read it.
+        return self._cached(self.compute_exposure, table_names, db_path, ("objects",))
+
+    def _cached(self, compute, table_names, db_path, tables=("objects", "risk_scores")):
+        table_names = tuple(sorted(table_names))
+        versions = get_table_versions(table_names + tables, db_path)
+        key = (compute.__name__, db_path, table_names, versions)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        result = compute(table_names, db_path)
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return result
+
+    def compute_summary(self, table_names, db_path="users.duckdb"):
+        exposure = self.get_exposure(table_names, db_path)
+        with connection(db_path, read_only=True) as conn:
+            conn.register("exposure", exposure)
+            result = conn.execute("""
+                WITH scored AS (
+                    SELECT e.wikidata_id, e.heading, COALESCE(r.value, 0) AS value
+                    FROM exposure e
+                    LEFT JOIN risk_scores r USING (wikidata_id, heading)
+                ),
+                totals AS (
+                    SELECT wikidata_id, SUM(value) AS total_risk
+                    FROM scored
+                    GROUP BY wikidata_id
+                ),
+                highest AS (
+                    SELECT t.wikidata_id, o.label, t.total_risk
+                    FROM totals t
+                    LEFT JOIN objects o USING (wikidata_id)
+                    ORDER BY t.total_risk DESC, t.wikidata_id
+                    LIMIT 1
+                ),
+                dominant AS (
+                    SELECT heading, AVG(value) AS avg_risk_value
+                    FROM scored
+                    GROUP BY heading
+                    ORDER BY avg_risk_value DESC, heading
+                    LIMIT 1
+                )
+                SELECT
+                    (SELECT COUNT(*) FROM totals),
+                    h.wikidata_id, h.label, h.total_risk,
+                    d.heading, d.avg_risk_value
+                FROM (SELECT 1) AS one
+                LEFT JOIN highest h ON TRUE
+                LEFT JOIN dominant d ON TRUE
+            """).fetchone()
+            conn.unregister("exposure")
+
+        affected, wikidata_id, label, total_risk, heading, avg_risk_value = result
+        risk_names = get_risk_names()
+        return {
+            "affected": affected,
+            "highest_risk": {
+                "wikidata_id": wikidata_id,
+                "label": label,
+                "total_risk": total_risk,
+            } if wikidata_id else None,
+            "dominant_risk": {
+                "heading": heading,
+                "name": risk_names.get(heading, heading),
+                "avg_risk_value": avg_risk_value,
+            } if heading else None,
+        }
+
+    def compute_plot_data(self, table_names, db_path="users.duckdb"):
+        # Long frame with one row per risk of each of the plot.top_objects
+        # objects at highest total risk: name, risk, value.
+        exposure = self.get_exposure(table_names, db_path)
+        with connection(db_path, read_only=True) as conn:
+            conn.register("exposure", exposure)
+            data = conn.execute("""
+                WITH scored AS (
+                    SELECT e.wikidata_id, e.heading, COALESCE(r.value, 0) AS value
+                    FROM exposure e
+                    LEFT JOIN risk_scores r USING (wikidata_id, heading)
+                ),
+                top AS (
+                    SELECT wikidata_id, SUM(value) AS total_risk
+                    FROM scored
+                    GROUP BY wikidata_id
+                    ORDER BY total_risk DESC, wikidata_id
+                    LIMIT ?
+                )
+                SELECT COALESCE(o.label, s.wikidata_id) AS name, s.heading AS risk, s.value
+                FROM scored s
+                JOIN top t USING (wikidata_id)
+                LEFT JOIN objects o USING (wikidata_id)
+                ORDER BY t.total_risk DESC, s.wikidata_id, s.heading
+            """, (config["plot"]["top_objects"],)).fetchdf()
+            conn.unregister("exposure")
+        data["risk"] = data["risk"].map(get_risk_names()).fillna(data["risk"])
+        return data
+
+    def compute_highest_risk(self, table_names, db_path="users.duckdb"):
+        # Series indexed by wikidata_id: the highest score each exposed
+        # object has under the heading of any active feature containing it.
+        # Objects outside every feature are left out.
+        exposure = self.get_exposure(table_names, db_path)
+        with connection(db_path, read_only=True) as conn:
+            conn.register("exposure", exposure)
+            data = conn.execute("""
+                SELECT e.wikidata_id, MAX(COALESCE(r.value, 0)) AS value
+                FROM exposure e
+                LEFT JOIN risk_scores r USING (wikidata_id, heading)
+                GROUP BY e.wikidata_id
+            """).fetchdf()
+            conn.unregister("exposure")
+        return data.set_index("wikidata_id")["value"]
+
+    def compute_exposure(self, table_names, db_path="users.duckdb"):
+        # One row per object and risk heading it is exposed to, where the
+        # heading is the 'name' of an active feature containing the object,
+        # or the feature's table name when it has none. Layers are read
+        # whole at full resolution, so the figures do not depend on the
+        # current viewport, and straight from their WKB rather than through
+        # the GeoJSON layer cache the map uses.
+        objects = get_object_locations(db_path)
+        if not table_names or objects.empty:
+            return pd.DataFrame({"wikidata_id": pd.Series(dtype=str), "heading": pd.Series(dtype=str)})
+        index = SpatialIndex.from_frames([read_layer(table_name, db_path) for table_name in table_names])
+        point_index, feature_index = index.join_points(objects["longitude"], objects["latitude"])
+        # Features without a name still count, under their table name.
+        names = index.get_property("name")
+        unnamed = pd.isna(names) | (names == "")
+        if unnamed.any():
+            layer_names = np.array(table_names, dtype=object)
+            counts = np.bincount(index.feature_layers[unnamed], minlength=len(layer_names))
+            for table_name, count in zip(layer_names, counts):
+                if count:
+                    print(f"{count} features of {table_name} have no name; counted under '{table_name}'.")
+            names = np.where(unnamed, layer_names[index.feature_layers], names)
+        exposure = pd.DataFrame({
+            "wikidata_id": objects["wikidata_id"].to_numpy()[point_index],
+            "heading": names[feature_index],
+        })
+        return exposure.drop_duplicates()
+
+
+def get_risk_names():
+    return {
+        risk["heading"]: risk["name"]
+        for risk in config["risk"].values() if isinstance(risk, dict)
+    }
+
+
+risk_analytics = RiskAnalytics()
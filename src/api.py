@@ -0,0 +1,33 @@
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from src.dbfunctions import search_objects
+from src.routing import with_routes
+from src.config import config
+
+
+async def search(request):
+    # GET ?q=<text>&limit=<n>: the best matches with their location and
+    # BM25 score, best first.
+    query = request.query_params.get("q", "").strip()
+    try:
+        limit = int(request.query_params.get("limit", config["search"]["limit"]))
+    except ValueError:
+        return JSONResponse({"error": "limit must be an integer"}, status_code=400)
+    if not query:
+        return JSONResponse({"error": "missing query parameter q"}, status_code=400)
+    limit = min(max(limit, 1), config["search"]["max_limit"])
+    results = await run_in_threadpool(search_objects, query, limit)
+    # Missing coordinates become null; JSON has no NaN.
+    results = results.astype(object).where(results.notna(), None)
+    return JSONResponse({"query": query, "results": results.to_dict(orient="records")})
+
+
+async def search_app(scope, receive, send):
+    response = await search(Request(scope, receive))
+    await response(scope, receive, send)
+
+
+def with_search_api(app, path=None):
+    # Answers object searches on path.
+    return with_routes(app, {path or config["search"]["api_path"]: search_app})
@@ -0,0 +1,13 @@
+import tomli
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def load_config(path="config.toml"):
+    # Parsed once per process and shared by every module; callers must
+    # treat the result as read-only.
+    with open(path, mode="rb") as fp:
+        return tomli.load(fp)
+
+
+config = load_config()
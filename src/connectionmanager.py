@@ -0,0 +1,133 @@
+import duckdb
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from src.config import config
+
+
+class ConnectionManager:
+    """
+    Owns a single DuckDB database instance and hands out cursors from a
+    bounded pool. A thread that already holds a cursor gets the same one
+    back on nested calls, so helpers can call each other without
+    exhausting the pool.
+
+    The instance is opened read-write and held for the life of the
+    process, and DuckDB lets only one process open a database file that
+    way. The app therefore runs as a single worker process per database
+    file; sessions share it through threads, not through more workers.
+    """
+
+    def __init__(self, db_path, pool_size=None):
+        self.db_path = db_path
+        self.pool_size = pool_size or config["database"]["pool_size"]
+        self.database = duckdb.connect(db_path)
+        self._idle = []
+        self._waiters = deque()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._metrics = {
+            "acquired": 0,
+            "waited": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "in_use": 0,
+        }
+
+    @contextmanager
+    def connection(self, read_only=False):
+        held = getattr(self._local, "cursor", None)
+        if held is not None:
+            if not read_only and self._local.read_only:
+                raise RuntimeError("Cannot open a write cursor inside a read-only one.")
+            yield held
+            return
+
+        # DuckDB aborts one of two transactions that write the same rows, so
+        # writers take turns; readers never wait for each other or for them.
+        if not read_only:
+            self._write_lock.acquire()
+        cursor = self._acquire()
+        self._local.cursor = cursor
+        self._local.read_only = read_only
+        cursor.begin()
+        try:
+            yield cursor
+        except BaseException:
+            cursor.rollback()
+            raise
+        else:
+            # Read-only cursors run inside a snapshot that is always
+            # discarded, so nothing they do can reach the database file.
+            if read_only:
+                cursor.rollback()
+            else:
+                cursor.commit()
+        finally:
+            self._local.cursor = None
+            self._release(cursor)
+            if not read_only:
+                self._write_lock.release()
+
+    def _acquire(self):
+        with self._lock:
+            self._metrics["acquired"] += 1
+            self._metrics["in_use"] += 1
+            if self._idle:
+                return self._idle.pop()
+            if self._created < self.pool_size:
+                self._created += 1
+                return self.database.cursor()
+            # Waiters are served in arrival order: a released cursor is
+            # handed straight to the oldest waiter instead of going back
+            # to the idle list, where a busy thread could grab it again.
+            waiter = [threading.Event(), None]
+            self._waiters.append(waiter)
+
+        start = time.perf_counter()
+        waiter[0].wait()
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._metrics["waited"] += 1
+            self._metrics["wait_seconds_total"] += waited
+            self._metrics["wait_seconds_max"] = max(self._metrics["wait_seconds_max"], waited)
+        return waiter[1]
+
+    def _release(self, cursor):
+        with self._lock:
+            self._metrics["in_use"] -= 1
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter[1] = cursor
+                waiter[0].set()
+            else:
+                self._idle.append(cursor)
+
+    def get_metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["pool_size"] = self.pool_size
+            metrics["created"] = self._created
+        return metrics
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+        self.database.close()
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_connection_manager(db_path):
+    with _managers_lock:
+        manager = _managers.get(db_path)
+        if manager is None:
+            manager = ConnectionManager(db_path)
+            _managers[db_path] = manager
+        return manager
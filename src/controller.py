@@ -1,39 +1,52 @@
-from shiny import ui, App, render, reactive
+from shiny import ui, App, render, reactive, req
 from shinywidgets import render_widget
 from src.mapmanager import MapManager
 from src.uimanager import UIManager
 from src.plotmanager import PlotManager
-from ipyleaflet import Map
-import tomli
-from src.dbfunctions import check_login, add_geodataframe, get_table_names, get_geospatial_data, add_object, get_objects
-import tempfile
-import zipfile
-import shutil
-import os
+from src.analytics import risk_analytics
+from src.objectingestor import object_ingestor
+from prometheus_client import Gauge
+from src.metrics import track_reactive, cache_collector
+from src.dbfunctions import check_login, add_archive, get_table_names, get_table_versions, get_data_version, get_data_versions, get_layer_extent, get_geospatial_data, get_objects, get_objects_page, migrate_layers, search_objects, build_search_index, OBJECT_TABLE_COLUMNS
+import asyncio
+import re
+import pandas as pd
+from src.config import config
 
 
-with open("config.toml", mode="rb") as fp:
-    config = tomli.load(fp)
+ACTIVE_SESSIONS = Gauge("risk_atlas_active_sessions", "Shiny sessions open in this worker")
 
 
 class AppController:
 
     def __init__(self):
-        self.map_manager = MapManager()
         self.ui_manager = UIManager()
         self.plot_manager = PlotManager()
+        cache_collector.register("plot", self.plot_manager.get_stats)
+        migrate_layers()
+        build_search_index()
+
+    def load_layer(self, table_name, bbox=None, zoom=None):
+        # Shared, read-only layer data; see LayerCache.
+        return get_geospatial_data(table_name, parsed=True, bbox=bbox, zoom=zoom)
 
     def ui(self, request=None):
         return self.ui_manager.create_ui()
 
 
     def server(self, input, output, session):
+        # Map widgets and the active layer set belong to one session; the
+        # parsed layer data they display is shared through layer_cache.
+        map_manager = MapManager(layer_loader=self.load_layer)
+        ACTIVE_SESSIONS.inc()
+        session.on_ended(ACTIVE_SESSIONS.dec)
         status_message = reactive.Value("")
         logged_in = reactive.Value(False)
         username = reactive.Value("")
 
         @reactive.Effect
         @reactive.event(input.login_button)
+        @track_reactive
         def check_credentials():
             username_input = input.username()
             password_input = input.password()
@@ -50,6 +63,7 @@ class AppController:
 
         @reactive.Effect
         @reactive.event(input.logout_button)
+        @track_reactive
         def logout():
             logged_in.set(False)
             username.set("")
@@ -57,6 +71,7 @@ class AppController:
 
         @output
         @render.ui
+        @track_reactive
         def login_content():
             if logged_in():
                 return ui.page_fluid(
@@ -73,6 +88,7 @@ class AppController:
                                 ui.input_action_button(
                                     "geodata_upload_button", 
                                     "Upload"),
+                                ui.output_ui("upload_report"),
                             ),
                         ),
                         ui.nav_panel(
@@ -80,12 +96,40 @@ class AppController:
                             ui.card(
                                 ui.input_text("object_id", "Object ID"),
                                 ui.input_action_button("add_object_button", "Add object", class_="btn-success"),
+                                ui.output_ui("import_report"),
+                            ),
+                            ui.card(
+                                ui.input_text_area(
+                                    "object_ids",
+                                    "Object IDs (one per line or comma separated)",
+                                    "\n".join(config["entity"]["entities"]),
+                                    rows=5
+                                ),
+                                ui.input_action_button("import_objects_button", "Import objects", class_="btn-success"),
                             ),
                             ui.card(
                                 ui.card_header(
                                     "Objects"
                                 ),
-                                ui.output_data_frame("object_table")
+                                ui.layout_columns(
+                                    ui.input_select("object_sort", "Sort by", OBJECT_TABLE_COLUMNS, selected="id"),
+                                    ui.input_checkbox("object_descending", "Descending", False),
+                                    ui.input_select("object_filter_column", "Filter on", OBJECT_TABLE_COLUMNS, selected="label"),
+                                    ui.input_text("object_filter_text", "Containing"),
+                                    ui.input_select(
+                                        "object_page_size",
+                                        "Rows per page",
+                                        [str(size) for size in config["object_table"]["page_sizes"]],
+                                        selected=str(config["object_table"]["page_size"])
+                                    ),
+                                ),
+                                ui.output_data_frame("object_table"),
+                                ui.div(
+                                    ui.input_action_button("object_previous_button", "Previous"),
+                                    ui.output_text("object_table_status", inline=True),
+                                    ui.input_action_button("object_next_button", "Next"),
+                                    class_="d-flex align-items-center gap-3",
+                                ),
                             ),
                         ),
                         ui.nav_panel(
@@ -115,6 +159,7 @@ class AppController:
         phase_counter = reactive.Value(0)
         @reactive.Effect
         @reactive.event(input.add_phase)
+        @track_reactive
         def add_phase():
             current_phase = phase_counter()
             ui.insert_ui(
@@ -135,6 +180,7 @@ class AppController:
             activity_block_counter = reactive.Value(0)
             @reactive.Effect
             @reactive.event(input[f"add_activity_{current_phase}"])
+            @track_reactive
             def add_activity_block():
                 current_activity = activity_block_counter()
                 ui.insert_ui(
@@ -156,6 +202,7 @@ class AppController:
                 observation_block_counter = reactive.Value(0)
                 @reactive.Effect
                 @reactive.event(input[f"add_observation_{current_phase}_{current_activity}"])
+                @track_reactive
                 def add_observation():
                     current_observation = observation_block_counter()
                     ui.insert_ui(
@@ -177,6 +224,7 @@ class AppController:
                     # Handle dynamic inputs based on observation type
                     @reactive.Effect
                     @reactive.event(input[f"observation_type_{current_phase}_{current_activity}_{current_observation}"])
+                    @track_reactive
                     def update_observation_type():
                         observation_type = input[f"observation_type_{current_phase}_{current_activity}_{current_observation}"]
                         
@@ -206,125 +254,373 @@ class AppController:
 
                     @reactive.Effect
                     @reactive.event(input[f"remove_observation_{current_phase}_{current_activity}_{current_observation}"])
+                    @track_reactive
                     def remove_observation():
                         ui.remove_ui(selector=f"#observation_{current_phase}_{current_activity}_{current_observation}")
 
                 @reactive.Effect
                 @reactive.event(input[f"remove_activity_{current_phase}_{current_activity}"])
+                @track_reactive
                 def remove_activity_block():
                     ui.remove_ui(selector=f"#activity_{current_phase}_{current_activity}")
 
             @reactive.Effect
             @reactive.event(input[f"remove_phase_{current_phase}"])
+            @track_reactive
             def remove_phase_block():
                 ui.remove_ui(selector=f"#phase_{current_phase}")
 
 
-        uploaded_file = reactive.Value(None)
+        # Every shapefile in the archive is ingested, read straight out of
+        # the zip by a pool of worker processes. The task waits for them in
+        # a thread, so other sessions keep being served meanwhile.
+        @reactive.extended_task
+        @track_reactive
+        async def archive_task(zip_file_path):
+            return await asyncio.to_thread(add_archive, zip_file_path)
+
+
         @reactive.Effect
         @reactive.event(input.geodata_upload_button)
+        @track_reactive
         def process_file():
             file = input.geodata_upload()
             if file:
-                zip_file_path = file[0]["datapath"]
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    try:
-                        with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
-                            zip_ref.extractall(temp_dir)
-                        file_path = None
-                        for root, dirs, files in os.walk(temp_dir):
-                            for file in files:
-                                if file.endswith(".shp"):
-                                    file_path = os.path.join(root, file)
-                                    break
-                            if file_path:
-                                break
-                        if file_path:
-                            add_geodataframe(file_path)
-                            print("File processed and added to the database successfully!")
-                    except Exception as e:
-                        print(f"Error processing file.")
+                archive_task(file[0]["datapath"])
             else:
                 print("No file uploaded.")
 
 
+        @render.ui
+        @track_reactive
+        def upload_report():
+            status = archive_task.status()
+            if status == "running":
+                return ui.p("Upload in progress...")
+            if status == "error":
+                error = archive_task.error()
+                print(f"Error processing file: {error!r}")
+                return ui.p(f"Upload failed: {type(error).__name__}: {error}", class_="text-danger")
+            if status != "success":
+                return None
+            report = archive_task.result()
+            if not report:
+                return ui.p("No shapefiles found in the archive.", class_="text-danger")
+            failures = [ui.tags.li(f"{table_name}: {layer['error']}") for table_name, layer in report.items() if layer["error"]]
+            return ui.div(
+                ui.p(f"Added {len(report) - len(failures)} of {len(report)} layers."),
+                ui.tags.ul(*failures) if failures else None,
+            )
+
+
+        @reactive.extended_task
+        @track_reactive
+        async def ingest_task(object_ids):
+            return await object_ingestor.ingest(object_ids)
+
+
         @reactive.Effect
         @reactive.event(input.add_object_button)
+        @track_reactive
         def add_object_event():
             object_id = input.object_id()
             if object_id:
-                add_object(object_id)
+                ingest_task(object_id.split())
+
+
+        @reactive.Effect
+        @reactive.event(input.import_objects_button)
+        @track_reactive
+        def import_objects_event():
+            object_ids = [object_id for object_id in re.split(r"[\s,]+", input.object_ids()) if object_id]
+            if object_ids:
+                ingest_task(object_ids)
+
+
+        # Data versions are polled from the database, so writes from any
+        # session of this process, including background imports, invalidate
+        # exactly the outputs that read the changed tables. Other processes
+        # cannot write meanwhile: the app holds the database file open for
+        # its lifetime (see ConnectionManager). A Value only invalidates
+        # when its version moves.
+        initial_versions = get_data_versions()
+        data_versions = {
+            table_name: reactive.Value(initial_versions.get(table_name, 0))
+            for table_name in ("objects", "risk_scores", "layers")
+        }
+
+        @reactive.poll(get_data_version, config["database"]["poll_seconds"])
+        @track_reactive
+        def polled_versions():
+            return get_data_versions()
+
+
+        @reactive.Effect
+        @track_reactive
+        def track_data_versions():
+            versions = polled_versions()
+            for table_name, version in data_versions.items():
+                version.set(versions.get(table_name, 0))
+
+
+        @render.ui
+        @track_reactive
+        def import_report():
+            status = ingest_task.status()
+            if status == "running":
+                return ui.p("Import in progress...")
+            if status == "error":
+                return ui.p(f"Import failed: {ingest_task.error()}", class_="text-danger")
+            if status != "success":
+                return None
+            report = ingest_task.result()
+            added = sum(1 for outcome in report.values() if outcome == "Added")
+            failures = [ui.tags.li(f"{entity_id}: {outcome}") for entity_id, outcome in report.items() if outcome != "Added"]
+            return ui.div(
+                ui.p(f"Added {added} of {len(report)} objects."),
+                ui.tags.ul(*failures) if failures else None,
+            )
 
 
         @reactive.Calc
+        @track_reactive
         def reactive_object_data():
+            data_versions["objects"]()
             return get_objects()
 
 
+        # The object grid only ever holds one page: sorting, filtering and
+        # paging run in DuckDB. Changing any grid setting starts over from
+        # the first page; Previous and Next move the keyset cursor.
+        object_query = reactive.Value(None)
+
+        @reactive.Effect
+        @reactive.event(input.object_sort, input.object_descending, input.object_filter_column, input.object_filter_text, input.object_page_size)
+        @track_reactive
+        def reset_object_page():
+            object_query.set({
+                "sort_by": input.object_sort(),
+                "descending": input.object_descending(),
+                "filters": {input.object_filter_column(): input.object_filter_text().strip()},
+                "limit": int(input.object_page_size()),
+                "after": None,
+                "before": None,
+                "offset": 0,
+            })
+
+
+        @reactive.Calc
+        @track_reactive
+        def object_page():
+            data_versions["objects"]()
+            query = object_query()
+            req(query)
+            return get_objects_page(
+                query["sort_by"], query["descending"], query["filters"],
+                query["after"], query["before"], query["limit"]
+            )
+
+
+        @reactive.Effect
+        @reactive.event(input.object_next_button)
+        @track_reactive
+        def next_object_page():
+            page = object_page()
+            if page["has_next"]:
+                query = object_query()
+                object_query.set({**query, "after": page["last"], "before": None, "offset": query["offset"] + len(page["data"])})
+
+
+        @reactive.Effect
+        @reactive.event(input.object_previous_button)
+        @track_reactive
+        def previous_object_page():
+            page = object_page()
+            if page["has_previous"]:
+                query = object_query()
+                object_query.set({**query, "after": None, "before": page["first"], "offset": max(query["offset"] - query["limit"], 0)})
+
+
         @render.data_frame
+        @track_reactive
         def object_table():
-            data = reactive_object_data()
-            return render.DataGrid(data, selection_mode="rows")
+            return render.DataGrid(object_page()["data"], selection_mode="rows")
+
+
+        @render.text
+        @track_reactive
+        def object_table_status():
+            page = object_page()
+            offset = object_query()["offset"]
+            if page["total"] == 0:
+                return "No objects"
+            return f"{offset + 1:,}-{offset + len(page['data']):,} of {page['total']:,}"
+
+
+        # Search answers from the full-text index; the map jumps to the best
+        # match, and to any other result picked from the list.
+        search_results = reactive.Value(None)
+
+        @reactive.Effect
+        @reactive.event(input.object_search_button)
+        @track_reactive
+        def search_object():
+            query = input.object_search().strip()
+            results = search_objects(query) if query else None
+            search_results.set(results)
+            if results is None:
+                return
+            if not results.empty:
+                focus_search_result(results.iloc[0])
+
+
+        @reactive.Effect
+        @reactive.event(input.search_result)
+        @track_reactive
+        def select_search_result():
+            results = search_results()
+            if results is None:
+                return
+            match = results[results["wikidata_id"] == input.search_result()]
+            if not match.empty:
+                focus_search_result(match.iloc[0])
+
+
+        def focus_search_result(result):
+            # Objects without coordinates are listed but the map stays put.
+            if map_manager.map is None or pd.isna(result["latitude"]) or pd.isna(result["longitude"]):
+                return
+            map_manager.focus_object(result["wikidata_id"], float(result["latitude"]), float(result["longitude"]))
+
+
+        @render.ui
+        @track_reactive
+        def search_results_list():
+            results = search_results()
+            if results is None:
+                return None
+            if results.empty:
+                return ui.p("No matches")
+            located = results["latitude"].notna() & results["longitude"].notna()
+            choices = {
+                wikidata_id: (label or wikidata_id) + ("" if is_located else " (no location)")
+                for wikidata_id, label, is_located in zip(results["wikidata_id"], results["label"], located)
+            }
+            return ui.input_radio_buttons("search_result", None, choices)
 
 
         selected_layers = reactive.Value([])
         @reactive.Effect
         @reactive.event(input.update_map_button)
+        @track_reactive
         async def update_map():
             with ui.Progress(min=0, max=100) as p:
                 p.set(message="Initializing", detail="Loading layers...")
-                
-                layers = []
-                num_tables = len(get_table_names())
-
-                for i, table_name in enumerate(get_table_names()):
-                    p.set(i * 100 // num_tables, message=f"Processing {table_name}")
-                    if input[f"file_{i}"]():
-                        geo_data = get_geospatial_data(table_name)
-                        layers.append(geo_data)
-                selected_layers.set(layers)
-                if layers:
-                    p.set(100, message="Rendering map...", detail="Finished loading layers.")
-                    self.map_manager.update_map(layers)
-                else:
-                    p.set(100, message="No layers to render.", detail="Clearing map.")
-                    self.map_manager.clear_map()       
+
+                table_names = get_table_names()
+                checked = [table_name for i, table_name in enumerate(table_names) if input[f"file_{i}"]()]
+                versions = dict(zip(checked, get_table_versions(checked)))
+                # Only newly checked or changed layers are fetched; the map
+                # manager hides and shows the ones it already holds.
+                p.set(50, message="Updating layers")
+                stats = map_manager.update_map(checked, versions)
+                selected_layers.set(checked)
+                p.set(100, message="Rendering map...", detail=f"{stats['added'] + stats['reloaded']} layers loaded.")
+                map_manager.update_markers(risk_analytics.get_highest_risk(checked))
+
+
+        @reactive.Effect
+        @reactive.event(data_versions["layers"], ignore_init=True)
+        @track_reactive
+        def refresh_layers():
+            # Reloads shown layers that were re-uploaded meanwhile.
+            checked = selected_layers.get()
+            if checked:
+                map_manager.update_map(checked, dict(zip(checked, get_table_versions(checked))))
+                map_manager.update_markers(risk_analytics.get_highest_risk(checked))
+
+
+        @reactive.Effect
+        @reactive.event(data_versions["objects"], data_versions["risk_scores"], ignore_init=True)
+        @track_reactive
+        def refresh_objects():
+            if map_manager.map is None:
+                return
+            if data_versions["objects"]() != map_manager.objects_version:
+                map_manager.set_objects(reactive_object_data())
+                map_manager.objects_version = data_versions["objects"]()
+            map_manager.update_markers(risk_analytics.get_highest_risk(selected_layers.get()))
+
+
+        @reactive.Effect
+        @reactive.event(input.zoom_layers_button)
+        @track_reactive
+        def zoom_layers():
+            table_names = get_table_names()
+            checked = [table_name for i, table_name in enumerate(table_names) if input[f"file_{i}"]()]
+            extent = get_layer_extent(checked or table_names)
+            if extent:
+                map_manager.fit_bounds(extent)
 
 
         @render_widget
+        @track_reactive
         def map():
-            map = self.map_manager.create_map()
-            entities = get_objects()
-            markers = self.map_manager.generate_markers(entities)
-            self.map_manager.add_markers(markers)
+            map = map_manager.create_map()
+            with reactive.isolate():
+                map_manager.add_objects(reactive_object_data())
+                map_manager.objects_version = data_versions["objects"]()
             #layers = get_selected_layers()
             #if layers:
-                #self.map_manager.add_active_layers(layers)
+                #map_manager.add_active_layers(layers)
                 
-                #self.map_manager.update_markers(markers)
+                #map_manager.update_markers(markers)
                 
-                #self.map_manager.update_value_boxes(input.box_1)
+                #map_manager.update_value_boxes(input.box_1)
             
             return map
 
         @render.ui
+        @track_reactive
         def layers():
+            data_versions["layers"]()
             tables = get_table_names()
-            checkboxes = [ui.input_checkbox(f"file_{i}", table) for i, table in enumerate(tables)]
-            return *checkboxes, ui.input_action_button("update_map_button", "Update Map")
+            with reactive.isolate():
+                checked = selected_layers()
+            checkboxes = [ui.input_checkbox(f"file_{i}", table, table in checked) for i, table in enumerate(tables)]
+            return (
+                *checkboxes,
+                ui.input_action_button("update_map_button", "Update Map"),
+                ui.input_action_button("zoom_layers_button", "Zoom to Layers"),
+            )
         
         
         @render.ui
+        @track_reactive
         def value_boxes():
-            boxes = [ui.column(4, ui.value_box(title, 0, id=f"box_{i}")) for i, title in enumerate(config["app"]["nav_panel_01"]["value_boxes"])]
+            for version in data_versions.values():
+                version()
+            summary = risk_analytics.get_summary(selected_layers())
+            highest_risk = summary["highest_risk"]
+            dominant_risk = summary["dominant_risk"]
+            values = [
+                f"{highest_risk['label'] or highest_risk['wikidata_id']} ({highest_risk['total_risk']})" if highest_risk else "-",
+                f"{dominant_risk['name']} ({dominant_risk['avg_risk_value']:.1f})" if dominant_risk else "-",
+                summary["affected"],
+            ]
+            boxes = [ui.column(4, ui.value_box(title, value, id=f"box_{i}")) for i, (title, value) in enumerate(zip(config["app"]["nav_panel_01"]["value_boxes"], values))]
             return ui.row(*boxes)
 
-        @render.plot
+        @render.ui
+        @track_reactive
         def plot():
-            plot = self.plot_manager.create_plot()
-            return plot
+            for version in data_versions.values():
+                version()
+            data = risk_analytics.get_plot_data(selected_layers())
+            return ui.img(src=self.plot_manager.create_plot_uri(data), style="width: 100%;", alt="Combined Risk Values")
 
         @render.data_frame
+        @track_reactive
         def table():
             #data = get_objects()
             #return render.DataGrid(data, selection_mode="rows")
@@ -333,8 +629,8 @@ class AppController:
 
         '''@reactive.Calc
         def get_selected_layers():
-            layer_group = self.map_manager.generate_layers()
+            layer_group = map_manager.generate_layers()
             layers = layer_group.layers
             selected_layers = [layers[i] for i in range(len(layers)) if input[f"file_{i}"]()]
-            self.map_manager.active_layers = selected_layers
+            map_manager.active_layers = selected_layers
             return selected_layers'''
\ No newline at end of file
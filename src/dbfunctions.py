@@ -1,72 +1,675 @@
-import duckdb
 import bcrypt
-import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
 import os
+import multiprocessing
+import tempfile
+import zipfile
 import sys
-from shapely import wkt
-from SPARQLWrapper import SPARQLWrapper, JSON
+import json
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from src.connectionmanager import get_connection_manager
+from src.layercache import layer_cache
+from src.sparqlcache import sparql_cache
+from src.metrics import track_db, track_sparql
+from src.config import config
 
+# geopandas, pyogrio and SPARQLWrapper are imported by the functions that
+# use them, so a worker can start serving before any layer is read.
+
+
+ENTITY_ID = re.compile(r"^Q[1-9][0-9]*$")
+
+OBJECT_COLUMNS = ["label", "alt_label", "description", "date", "latitude", "longitude", "property", "official_site", "viaf"]
+
+# Columns the object grid can sort and filter on; the numeric ones sort
+# with NULLs first, as -infinity.
+OBJECT_TABLE_COLUMNS = ["id", "wikidata_id", *OBJECT_COLUMNS]
+NUMERIC_OBJECT_COLUMNS = {"id", "latitude", "longitude"}
+
+# Text indexed for object search, and the DuckDB expression splitting a
+# text into lower-case, accent-free word terms. Terms only hold [a-z0-9],
+# so every term starting with a prefix sorts below prefix + "{".
+SEARCH_COLUMNS = ["label", "alt_label", "description", "property"]
+SEARCH_RESULT_COLUMNS = ["wikidata_id", "label", "description", "latitude", "longitude", "score"]
+SEARCH_TERMS = "list_filter(regexp_split_to_array(lower(strip_accents({})), '[^a-z0-9]+'), term -> term <> '')"
+
+BBOX_COLUMNS = ["bbox_minx", "bbox_miny", "bbox_maxx", "bbox_maxy"]
+
+# Tables the app keeps next to the layers, which no upload may replace.
+RESERVED_TABLES = {
+    "users", "sparql_cache", "objects", "table_versions", "layers",
+    "object_terms", "object_documents", "search_index", "risk_scores",
+}
+
+
+def derived_columns():
+    # Columns a layer table gets at ingest on top of the uploaded
+    # attributes: the geometry, its pyramid levels and its bbox.
+    return ["geometry", *(f"geometry_z{zoom}" for zoom in config["map"]["simplify_zooms"]), *BBOX_COLUMNS]
+
+SCHEMA = [
+    "CREATE SCHEMA IF NOT EXISTS staging",
+    "CREATE SEQUENCE IF NOT EXISTS seq_id",
+    """
+    CREATE TABLE IF NOT EXISTS objects (
+        id INTEGER PRIMARY KEY,
+        wikidata_id VARCHAR UNIQUE NOT NULL,
+        label VARCHAR,
+        alt_label VARCHAR,
+        description VARCHAR,
+        date VARCHAR,
+        latitude DOUBLE,
+        longitude DOUBLE,
+        property VARCHAR,
+        official_site VARCHAR,
+        viaf VARCHAR
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS table_versions (
+        table_name VARCHAR PRIMARY KEY,
+        version BIGINT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS layers (
+        table_name VARCHAR PRIMARY KEY,
+        source_crs VARCHAR,
+        minx DOUBLE,
+        miny DOUBLE,
+        maxx DOUBLE,
+        maxy DOUBLE,
+        feature_count BIGINT NOT NULL,
+        vertex_count BIGINT,
+        byte_size BIGINT,
+        ingested_at TIMESTAMP NOT NULL,
+        version BIGINT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS object_terms (
+        term VARCHAR NOT NULL,
+        object_id INTEGER NOT NULL,
+        frequency INTEGER NOT NULL,
+        length INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS object_documents (
+        object_id INTEGER PRIMARY KEY,
+        length INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS search_index (
+        sorted_postings BIGINT NOT NULL,
+        documents BIGINT NOT NULL,
+        total_length BIGINT NOT NULL,
+        objects_version BIGINT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS risk_scores (
+        wikidata_id VARCHAR NOT NULL,
+        heading VARCHAR NOT NULL,
+        value INTEGER NOT NULL,
+        PRIMARY KEY (wikidata_id, heading)
+    )
+    """,
+]
 
-def check_login(username, password, db_path="users.duckdb"):
-    conn = duckdb.connect(db_path)
 
-    result = conn.execute("""
-    SELECT password_hash 
-    FROM users
-    WHERE username = ?
-    """, (username,)).fetchone()
+def connection(db_path, read_only=False):
+    manager = get_connection_manager(db_path)
+    if not getattr(manager, "schema_ready", False):
+        with manager.connection() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+        manager.schema_ready = True
+    return manager.connection(read_only=read_only)
+
+
+@track_db
+def check_login(username, password, db_path="users.duckdb"):
+    with connection(db_path, read_only=True) as conn:
+        result = conn.execute("""
+        SELECT password_hash 
+        FROM users
+        WHERE username = ?
+        """, (username,)).fetchone()
 
     if result and bcrypt.checkpw(password.encode(), result[0].encode()):
         return True
     return False
 
 
-def add_geodataframe(file_path, db_path="users.duckdb"):
-    conn = duckdb.connect(db_path)
-    table_name = os.path.basename(file_path).replace('.shp', '')
-    table_name_quoted = f'"{table_name}"'
-    gdf = gpd.read_file(file_path)
-    if "geometry" in gdf.columns:
-        gdf["geometry"] = gdf["geometry"].apply(lambda geom: geom.wkt if isinstance(geom, object) else geom)
-    else:
+@track_db
+def add_geodataframe(file_path, db_path="users.duckdb", batch_size=None, progress=None):
+    # file_path may be any GDAL path, including /vsizip/<archive>/<layer>.shp
+    # so layers are read straight out of an uploaded zip. Features are
+    # streamed in Arrow batches and appended to a staging table, so memory
+    # stays bounded by the batch size rather than the layer size.
+    table_name = layer_name(file_path)
+    check_layer_name(table_name, db_path)
+    staging = f'staging."{table_name}"'
+    report = {}
+    rows = 0
+    start = time.perf_counter()
+
+    source_crs = None
+
+    try:
+        for table, batch_report, source_crs in iter_batches(file_path, batch_size):
+            with connection(db_path) as conn:
+                conn.register("batch_data", table)
+                if rows == 0:
+                    conn.execute(f"CREATE OR REPLACE TABLE {staging} AS SELECT * FROM batch_data")
+                else:
+                    conn.execute(f"INSERT INTO {staging} SELECT * FROM batch_data")
+                conn.unregister("batch_data")
+            merge_reports(report, batch_report)
+            rows += table.num_rows
+            elapsed = time.perf_counter() - start
+            if progress:
+                progress(rows, rows / elapsed if elapsed else 0)
+
+        if rows:
+            with connection(db_path) as conn:
+                publish_layer(conn, table_name, staging, source_crs, report)
+    finally:
+        # A failed ingest leaves no partial staging table behind.
+        with connection(db_path) as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {staging}")
+    layer_cache.invalidate((db_path, table_name))
+
+    elapsed = time.perf_counter() - start
+    print(f"Ingested {rows} features into {table_name} in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s).")
+    for level, values in report.items():
+        print(f"{table_name} {level}: {values['vertices']} vertices, {values['bytes']} bytes")
+    return report
+
+
+@track_db
+def add_archive(zip_path, db_path="users.duckdb", max_workers=None, batch_size=None):
+    # Ingests every shapefile in a zip archive. Reading, reprojecting and
+    # simplifying run in a process pool, each worker writing its layer to a
+    # temporary parquet file; this process then loads the files into DuckDB
+    # one at a time, in archive order, since the database has one writer.
+    # Returns {table_name: {"features", "seconds", "error"}}.
+    with zipfile.ZipFile(zip_path) as archive:
+        members = [name for name in archive.namelist() if name.lower().endswith(".shp")]
+    max_workers = max_workers or config["ingest"]["workers"]
+    report = {}
+    layers = {}
+    for member in members:
+        table_name = layer_name(member)
+        if table_name in layers:
+            report.setdefault(table_name, {"features": 0, "seconds": 0.0, "error": f"Duplicate layer name in {member}"})
+            continue
+        try:
+            check_layer_name(table_name, db_path)
+        except ValueError as e:
+            report[table_name] = {"features": 0, "seconds": 0.0, "error": str(e)}
+            continue
+        layers[table_name] = f"/vsizip/{zip_path}/{member}"
+    if not layers:
+        return report
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Workers are spawned rather than forked so they do not inherit open
+        # DuckDB handles or the threads of the server process.
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(min(max_workers, len(layers)), mp_context=context) as executor:
+            futures = {
+                table_name: executor.submit(
+                    prepare_layer,
+                    file_path,
+                    os.path.join(temp_dir, f"{index}.parquet"),
+                    batch_size
+                )
+                for index, (table_name, file_path) in enumerate(layers.items())
+            }
+            for table_name, future in futures.items():
+                try:
+                    out_path, rows, seconds, source_crs, layer_report = future.result()
+                    start = time.perf_counter()
+                    if rows:
+                        with connection(db_path) as conn:
+                            publish_layer(
+                                conn,
+                                table_name,
+                                f"read_parquet('{out_path}')",
+                                source_crs,
+                                layer_report
+                            )
+                        layer_cache.invalidate((db_path, table_name))
+                    report[table_name] = {
+                        "features": rows,
+                        "seconds": seconds + time.perf_counter() - start,
+                        "error": None,
+                    }
+                except Exception as e:
+                    report[table_name] = {"features": 0, "seconds": 0.0, "error": str(e)}
+                print(f"{table_name}: {report[table_name]}")
+    return report
+
+
+def prepare_layer(file_path, out_path, batch_size=None):
+    # Runs in a worker process: reads a layer and writes the columns that
+    # will be stored to a parquet file. Returns the file, rows, seconds,
+    # source CRS and pyramid report.
+    start = time.perf_counter()
+    rows = 0
+    writer = None
+    source_crs = None
+    report = {}
+    try:
+        for table, batch_report, source_crs in iter_batches(file_path, batch_size):
+            if writer is None:
+                writer = pq.ParquetWriter(out_path, table.schema)
+            writer.write_table(table)
+            merge_reports(report, batch_report)
+            rows += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return out_path, rows, time.perf_counter() - start, source_crs, report
+
+
+def layer_name(file_path):
+    # Table names are quoted into SQL, so only [A-Za-z0-9_] is kept.
+    name = re.sub(r"[^A-Za-z0-9_]", "_", os.path.splitext(os.path.basename(file_path))[0])
+    return name or "layer"
+
+
+def check_layer_name(table_name, db_path="users.duckdb"):
+    # An upload may create a new table or replace a catalogued layer, but
+    # never one of the app's own tables. DuckDB names are case-insensitive.
+    if table_name.lower() in RESERVED_TABLES:
+        raise ValueError(f"{table_name} is reserved and cannot be used as a layer name")
+    with connection(db_path, read_only=True) as conn:
+        clash = conn.execute("""
+            SELECT table_name
+            FROM information_schema.tables
+            WHERE table_schema = 'main'
+            AND lower(table_name) = lower(?)
+            AND lower(table_name) NOT IN (SELECT lower(table_name) FROM layers)
+        """, (table_name,)).fetchone()
+    if clash:
+        raise ValueError(f"{table_name} is not a layer and cannot be replaced")
+
+
+def iter_batches(file_path, batch_size=None):
+    # Yields (table, report, source_crs) for every Arrow batch of a layer,
+    # with the stored geometry columns already derived in EPSG:4326.
+    # Files without a .prj are assumed to be in ingest.default_crs.
+    from pyogrio.raw import open_arrow
+    batch_size = batch_size or config["ingest"]["batch_size"]
+    with open_arrow(file_path, batch_size=batch_size, use_pyarrow=True) as (meta, reader):
+        source_crs = meta["crs"] or config["ingest"]["default_crs"]
+        geometry = geometry_column(reader.schema)
+        for batch in reader:
+            table, report = read_batch(batch, source_crs, geometry)
+            yield table, report, source_crs
+
+
+def geometry_column(schema):
+    # The WKB column of an Arrow stream from GDAL: the field tagged with a
+    # geoarrow extension type, or the one named in the schema metadata.
+    for field in schema:
+        if (field.metadata or {}).get(b"ARROW:extension:name", b"").startswith(b"geoarrow"):
+            return field.name
+    name = (schema.metadata or {}).get(b"geometry_column")
+    return name.decode() if name else None
+
+
+def merge_reports(report, batch_report):
+    for level, values in batch_report.items():
+        totals = report.setdefault(level, {"vertices": 0, "bytes": 0})
+        totals["vertices"] += values["vertices"]
+        totals["bytes"] += values["bytes"]
+
+
+def read_batch(batch, source_crs, geometry_name):
+    # Attribute columns keep the Arrow types GDAL reported, so a column that
+    # happens to be empty in the first batch is still typed correctly.
+    import geopandas as gpd
+    table = pa.table(batch)
+    if geometry_name not in table.column_names:
         print("No geometry column found")
+        return table, {}
+    geometry = gpd.GeoSeries(
+        shapely.from_wkb(table.column(geometry_name).to_numpy(zero_copy_only=False)),
+        crs=source_crs
+    ).to_crs(4326)
+    table = table.drop_columns([geometry_name])
+    columns, report = geometry_columns(geometry)
+    for name, values in columns.items():
+        table = table.append_column(name, pa.array(values))
+    return table, report
+
+
+def to_wkb_frame(gdf):
+    # gdf must already be in EPSG:4326. Returns the frame to store and its
+    # pyramid report.
+    df = pd.DataFrame(gdf.drop(columns="geometry"))
+    columns, report = geometry_columns(gdf.geometry)
+    for name, values in columns.items():
+        df[name] = values
+    return df, report
+
+
+def geometry_columns(geometry):
+    # Geometries are stored as WKB blobs in EPSG:4326, which DuckDB spatial
+    # can read directly with ST_GeomFromWKB and shapely can decode in one
+    # call. Returns the stored columns derived from a GeoSeries together
+    # with the vertex count and GeoJSON size of every pyramid level.
+    columns = {"geometry": shapely.to_wkb(geometry.values)}
+    report = {"geometry": level_stats(geometry.values)}
+    bounds = shapely.bounds(geometry.values)
+    for i, name in enumerate(BBOX_COLUMNS):
+        columns[name] = bounds[:, i]
+    for zoom in config["map"]["simplify_zooms"]:
+        simplified = shapely.simplify(
+            geometry.values,
+            simplify_tolerance(zoom),
+            preserve_topology=True
+        )
+        columns[f"geometry_z{zoom}"] = shapely.to_wkb(simplified)
+        report[f"geometry_z{zoom}"] = level_stats(simplified)
+    return columns, report
+
+
+def level_stats(geometry):
+    # Features without a geometry add nothing to either figure.
+    geometry = geometry[~shapely.is_missing(geometry)]
+    return {
+        "vertices": int(shapely.get_num_coordinates(geometry).sum()),
+        "bytes": sum(map(len, shapely.to_geojson(geometry))),
+    }
+
+
+def simplify_tolerance(zoom):
+    # One screen pixel at this zoom, in degrees of longitude.
+    return 360 / (256 * 2 ** zoom)
+
+
+def pyramid_level(zoom):
+    # The coarsest level whose zoom still covers the requested one; beyond
+    # the last level the full-resolution geometry is served.
+    if zoom is None:
+        return "geometry"
+    for level in sorted(config["map"]["simplify_zooms"]):
+        if zoom <= level:
+            return f"geometry_z{level}"
+    return "geometry"
+
+
+def write_layer(conn, table_name, df, source_crs=None, report=None):
+    conn.register("layer_data", df)
+    publish_layer(conn, table_name, "layer_data", source_crs, report)
+    conn.unregister("layer_data")
+
+
+def publish_layer(conn, table_name, source, source_crs=None, report=None):
+    # source is any relation holding the stored columns of a layer. Rows are
+    # clustered by extent so DuckDB's per-row-group min/max statistics can
+    # skip most of the table for a small viewport.
+    columns = [row[0] for row in conn.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+    has_bbox = "bbox_miny" in columns
+    order_by = "ORDER BY bbox_miny, bbox_minx" if has_bbox else ""
     conn.execute(f"""
-        CREATE TABLE IF NOT EXISTS {table_name_quoted} AS
-        SELECT * FROM gdf
+        CREATE OR REPLACE TABLE "{table_name}" AS
+        SELECT * FROM {source}
+        {order_by}
     """)
-    conn.commit()
+    bump_table_version(conn, table_name)
+    # The catalog as a whole is versioned too, so listings can be refreshed.
+    bump_table_version(conn, "layers")
+    full = (report or {}).get("geometry", {})
+    extent = "min(bbox_minx), min(bbox_miny), max(bbox_maxx), max(bbox_maxy)" if has_bbox else "NULL, NULL, NULL, NULL"
+    conn.execute(f"""
+        INSERT OR REPLACE INTO layers
+        SELECT
+            ?, ?, {extent}, count(*), ?, ?, now(),
+            (SELECT version FROM table_versions WHERE table_name = ?)
+        FROM "{table_name}"
+    """, (table_name, source_crs, full.get("vertices"), full.get("bytes"), table_name))
+
+
+def from_arrow_table(table):
+    import geopandas as gpd
+    if "geometry" not in table.column_names:
+        return gpd.GeoDataFrame(table.to_pandas())
+    geometry = shapely.from_wkb(table.column("geometry").to_numpy(zero_copy_only=False))
+    df = table.drop_columns(["geometry"]).to_pandas()
+    return gpd.GeoDataFrame(df, geometry=geometry, crs=4326)
+
+
+@track_db
+def migrate_layers(db_path="users.duckdb"):
+    # Brings tables written by older versions up to the current layout.
+    # Layers missing from the catalog were stored in ingest.default_crs,
+    # as WKT text or WKB; they are reprojected to EPSG:4326, their bbox and
+    # pyramid columns derived again and a catalog entry added.
+    import geopandas as gpd
+    source_crs = config["ingest"]["default_crs"]
+    with connection(db_path) as conn:
+        tables = conn.execute("""
+            SELECT c.table_name, c.data_type
+            FROM information_schema.columns c
+            WHERE c.column_name = 'geometry'
+            AND c.table_schema = 'main'
+            AND c.table_name NOT IN (SELECT table_name FROM layers)
+        """).fetchall()
+        for table_name, data_type in tables:
+            table = pa.table(conn.execute(f'SELECT * FROM "{table_name}"').arrow())
+            table = table.drop_columns([
+                c for c in derived_columns()
+                if c != "geometry" and c in table.column_names
+            ])
+            values = table.column("geometry").to_numpy(zero_copy_only=False)
+            geometry = shapely.from_wkt(values) if data_type == "VARCHAR" else shapely.from_wkb(values)
+            gdf = gpd.GeoDataFrame(table.drop_columns(["geometry"]).to_pandas(), geometry=geometry, crs=source_crs)
+            df, report = to_wkb_frame(gdf.to_crs(4326))
+            write_layer(conn, table_name, df, source_crs, report)
+            print(f"Migrated {table_name} to the current layer format.")
+    for table_name, _ in tables:
+        layer_cache.invalidate((db_path, table_name))
+    return [table_name for table_name, _ in tables]
+
+
+def bump_table_version(conn, table_name):
+    conn.execute("""
+        INSERT INTO table_versions VALUES (?, 1)
+        ON CONFLICT (table_name) DO UPDATE SET version = version + 1
+    """, (table_name,))
+
+
+@track_db
+def get_table_version(table_name, db_path="users.duckdb"):
+    with connection(db_path, read_only=True) as conn:
+        result = conn.execute("""
+            SELECT version
+            FROM table_versions
+            WHERE table_name = ?
+        """, (table_name,)).fetchone()
+    return result[0] if result else 0
+
+
+@track_db
+def get_table_versions(table_names, db_path="users.duckdb"):
+    with connection(db_path, read_only=True) as conn:
+        result = dict(conn.execute("""
+            SELECT table_name, version
+            FROM table_versions
+            WHERE list_contains(?, table_name)
+        """, (list(table_names),)).fetchall())
+    return tuple(result.get(table_name, 0) for table_name in table_names)
+
+
+@track_db
+def get_data_version(db_path="users.duckdb"):
+    # Grows on every write to any versioned table, so a single cheap query
+    # tells pollers whether anything changed at all.
+    with connection(db_path, read_only=True) as conn:
+        result = conn.execute("""
+            SELECT COALESCE(SUM(version), 0)
+            FROM table_versions
+        """).fetchone()
+    return result[0]
+
 
+@track_db
+def get_data_versions(db_path="users.duckdb"):
+    with connection(db_path, read_only=True) as conn:
+        result = conn.execute("""
+            SELECT table_name, version
+            FROM table_versions
+        """).fetchall()
+    return dict(result)
 
+
+@track_db
 def get_table_names(db_path="users.duckdb"):
-    conn = duckdb.connect(db_path)
-    result = conn.execute("""
-        SELECT table_name
-        FROM information_schema.columns
-        WHERE column_name = 'geometry'
-        AND table_schema = 'main'    
-    """).fetchall()
+    with connection(db_path, read_only=True) as conn:
+        result = conn.execute("""
+            SELECT table_name
+            FROM layers
+            ORDER BY table_name
+        """).fetchall()
     table_names = [row[0] for row in result]
-    conn.close()
     return table_names
 
 
-def get_geospatial_data(table_name, db_path="users.duckdb"):
-    conn = duckdb.connect(db_path)
+@track_db
+def get_layers(db_path="users.duckdb"):
+    with connection(db_path, read_only=True) as conn:
+        layers = conn.execute("""
+            SELECT *
+            FROM layers
+            ORDER BY table_name
+        """).fetchdf()
+    return layers
+
+
+@track_db
+def get_layer_extent(table_names, db_path="users.duckdb"):
+    # Combined (west, south, east, north) extent of the given layers in
+    # EPSG:4326, or None when none of them has one.
+    with connection(db_path, read_only=True) as conn:
+        extent = conn.execute("""
+            SELECT min(minx), min(miny), max(maxx), max(maxy)
+            FROM layers
+            WHERE list_contains(?, table_name)
+        """, (list(table_names),)).fetchone()
+    return None if extent[0] is None else extent
+
+
+@track_db
+def get_layer_version(table_name, db_path="users.duckdb"):
+    with connection(db_path, read_only=True) as conn:
+        result = conn.execute("""
+            SELECT version
+            FROM layers
+            WHERE table_name = ?
+        """, (table_name,)).fetchone()
+    return result[0] if result else 0
+
+
+@track_db
+def get_layer_size(table_name, db_path="users.duckdb"):
+    # GeoJSON bytes of the full-resolution layer, as measured at ingest.
+    with connection(db_path, read_only=True) as conn:
+        result = conn.execute("""
+            SELECT byte_size
+            FROM layers
+            WHERE table_name = ?
+        """, (table_name,)).fetchone()
+    return result[0] if result else None
+
+
+@track_db
+def get_geospatial_data(table_name, db_path="users.duckdb", parsed=False, bbox=None, zoom=None):
+    if bbox is not None:
+        return get_geospatial_data_in_bbox(table_name, bbox, zoom, db_path, parsed)
+    return get_cached_layer(table_name, db_path, parsed, zoom)
+
+
+def get_cached_layer(table_name, db_path="users.duckdb", parsed=False, zoom=None, with_bounds=False):
+    # The layer at the pyramid level for zoom, from the layer cache. The
+    # stored full-resolution bounds of its features are read in the same
+    # query and cached with it, so a viewport query filters the very
+    # features it returns.
+    level = pyramid_level(zoom)
+    key = (db_path, table_name, level)
+    version = get_layer_version(table_name, db_path)
+    cached = layer_cache.get(key, version, parsed=parsed, with_bounds=with_bounds)
+    if cached is not None:
+        return cached
+    gdf = read_layer(table_name, db_path, level, bounds=True)
+    bounds = gdf[BBOX_COLUMNS].to_numpy(dtype=float)
+    return layer_cache.put(
+        key, version, gdf.drop(columns=BBOX_COLUMNS).to_json(), parsed=parsed,
+        bounds=bounds, with_bounds=with_bounds
+    )
+
+
+@track_db
+def get_geospatial_data_in_bbox(table_name, bbox, zoom=None, db_path="users.duckdb", parsed=False):
+    # bbox is (west, south, east, north) in EPSG:4326. At a given zoom,
+    # features smaller than a screen pixel in both directions are skipped.
+    # Simplified levels of layers up to cache.shared_layer_max_mb are cached
+    # whole and filtered by their cached bounds, so every session viewing
+    # them shares the same parsed feature dicts. Full-resolution geometry
+    # and larger layers are read from the table, viewport features only.
+    minx, miny, maxx, maxy = bbox
+    min_size = simplify_tolerance(zoom) if zoom is not None else 0
+    level = pyramid_level(zoom)
+    size = get_layer_size(table_name, db_path)
+    if level == "geometry" or (size or 0) > config["cache"]["shared_layer_max_mb"] * 1024 * 1024:
+        # Features without a geometry have NaN bounds and never match.
+        gdf = read_layer(table_name, db_path, level, where="""
+            WHERE bbox_maxx >= ? AND bbox_minx <= ?
+            AND bbox_maxy >= ? AND bbox_miny <= ?
+            AND (bbox_maxx - bbox_minx >= ? OR bbox_maxy - bbox_miny >= ?)
+            AND NOT isnan(bbox_minx)
+        """, params=(minx, maxx, miny, maxy, min_size, min_size))
+        payload = gdf.to_json()
+        return json.loads(payload) if parsed else payload
+
+    layer, bounds = get_cached_layer(table_name, db_path, parsed=True, zoom=zoom, with_bounds=True)
+    keep = (
+        (bounds[:, 2] >= minx) & (bounds[:, 0] <= maxx)
+        & (bounds[:, 3] >= miny) & (bounds[:, 1] <= maxy)
+        & ((bounds[:, 2] - bounds[:, 0] >= min_size) | (bounds[:, 3] - bounds[:, 1] >= min_size))
+    )
+    features = layer["features"]
+    data = {"type": "FeatureCollection", "features": [features[row] for row in np.flatnonzero(keep)]}
+    return data if parsed else json.dumps(data)
+
+
+@track_db
+def read_layer(table_name, db_path="users.duckdb", level="geometry", where="", params=None, bounds=False):
+    # With bounds, the stored bbox columns are read along with the features.
+    bbox_columns = "".join(f"{column}, " for column in BBOX_COLUMNS) if bounds else ""
     query = f"""
-        SELECT * FROM '{table_name}'
+        SELECT
+            * EXCLUDE ({", ".join(f'"{column}"' for column in derived_columns())}),
+            {bbox_columns}{level} AS geometry
+        FROM "{table_name}"
+        {where}
     """
-    result = conn.execute(query).fetchall()
-    columns = [col[0] for col in conn.description]
-    gdf = gpd.GeoDataFrame(result, columns=columns)
-    if "geometry" in gdf.columns:
-        gdf["geometry"] = gdf["geometry"].apply(wkt.loads)
-        gdf.set_geometry("geometry", inplace=True)
-        if gdf.crs != 4326:
-            gdf.set_crs(32632, allow_override=True, inplace=True)
-            gdf = gdf.to_crs(4326)
-    conn.close()
-    return gdf.to_json()
+    with connection(db_path, read_only=True) as conn:
+        table = pa.table(conn.execute(query, params).arrow())
+    return from_arrow_table(table)
 
 
 def build_query(entity_id):
@@ -106,62 +709,436 @@ def transform_to_dict(results):
     return [process_item(d) for d in results]
 
 
-def get_entity_data(entity_id):
-    query = build_query(entity_id)
-    user_agent = f"WDQS-example Python/{sys.version_info[0]}.{sys.version_info[1]}"
-    endpoint_url = "https://query.wikidata.org/sparql"
-    
+def build_values_query(entity_ids):
+    values = "VALUES ?entity { " + " ".join(f"wd:{entity_id}" for entity_id in entity_ids) + " }"
+    return config["entity"]["query"].replace("VALUES_CLAUSE", values)
+
+
+def run_sparql_query(query, endpoint_url=None):
+    endpoint_url = endpoint_url or config["entity"]["endpoint_url"]
+    return sparql_cache.get(query, endpoint_url, lambda: fetch_sparql_bindings(query, endpoint_url))
+
+
+@track_sparql
+def fetch_sparql_bindings(query, endpoint_url):
+    from SPARQLWrapper import SPARQLWrapper, JSON, POST
+    from SPARQLWrapper.SPARQLExceptions import EndPointNotFound, QueryBadFormed, Unauthorized, URITooLong
+    user_agent = config["entity"]["user_agent"].format(sys=sys)
+    settings = config["entity"]["ingest"]
+
     sparql = SPARQLWrapper(endpoint_url, agent=user_agent)
     sparql.setQuery(query)
+    # Batched VALUES queries quickly outgrow what fits in a GET URL.
+    sparql.setMethod(POST)
     sparql.setReturnFormat(JSON)
+    sparql.setTimeout(settings["timeout"])
+
+    for attempt in range(settings["retries"] + 1):
+        try:
+            return sparql.queryAndConvert()["results"]["bindings"]
+        except (QueryBadFormed, Unauthorized, EndPointNotFound, URITooLong):
+            raise
+        except Exception as e:
+            if attempt == settings["retries"]:
+                raise
+            delay = settings["backoff"] * 2 ** attempt
+            print(f"SPARQL request failed ({e}), retrying in {delay:.1f}s.")
+            time.sleep(delay)
 
-    results = sparql.queryAndConvert()["results"]["bindings"]
+
+def get_entity_data(entity_id, endpoint_url=None):
+    query = build_query(entity_id)
+    results = run_sparql_query(query, endpoint_url)
     return transform_to_dict(results)
 
 
+def get_entities_data(entity_ids, endpoint_url=None):
+    # Returns the entities found, keyed by ID, and the IDs whose bindings
+    # could not be read, with the reason.
+    results = run_sparql_query(build_values_query(entity_ids), endpoint_url)
+    entities = {}
+    errors = {}
+    for binding in results:
+        entity_id = binding["entity"]["value"].rsplit("/", 1)[-1]
+        try:
+            entities[entity_id] = transform_to_dict([binding])[0]
+        except ValueError as e:
+            errors[entity_id] = f"Unreadable data: {e}"
+    return entities, errors
+
+
+def insert_objects(conn, entities):
+    # One INSERT ... SELECT over a registered frame. Known IDs are skipped
+    # with an anti join: both executemany and INSERT OR IGNORE cost
+    # milliseconds per row once the table is large.
+    rows = pd.DataFrame(
+        [[entity_id, *[entity.get(column) or None for column in OBJECT_COLUMNS]] for entity_id, entity in entities],
+        columns=["wikidata_id", *OBJECT_COLUMNS],
+        dtype=object
+    ).drop_duplicates("wikidata_id")
+    conn.register("object_rows", rows)
+    conn.execute(f"""
+    INSERT INTO objects (id, wikidata_id, {", ".join(OBJECT_COLUMNS)})
+    SELECT nextval('seq_id'), r.wikidata_id, {", ".join(f"r.{column}" for column in OBJECT_COLUMNS)}
+    FROM object_rows r
+    ANTI JOIN objects o ON o.wikidata_id = r.wikidata_id
+    """)
+    conn.unregister("object_rows")
+    bump_table_version(conn, "objects")
+    index_objects(conn)
+
+
+def index_objects(conn):
+    # Adds every object missing from the search index: one posting per term
+    # and object, with the term's frequency and the object's length in
+    # terms for BM25. Called in the transaction that inserts objects, so the
+    # index is never behind the table. It only appends: sorting the
+    # postings is left to compact_search_index.
+    text = f"concat_ws(' ', {', '.join(SEARCH_COLUMNS)})"
+    conn.execute(f"""
+        CREATE OR REPLACE TEMP TABLE new_documents AS
+        SELECT o.id AS object_id, {SEARCH_TERMS.format(text)} AS terms
+        FROM objects o
+        ANTI JOIN object_documents d ON d.object_id = o.id
+    """)
+    documents, total_length = conn.execute("SELECT COUNT(*), COALESCE(SUM(len(terms)), 0) FROM new_documents").fetchone()
+    if documents:
+        conn.execute("""
+            INSERT INTO object_terms
+            SELECT term, object_id, COUNT(*), ANY_VALUE(length)
+            FROM (SELECT object_id, unnest(terms) AS term, len(terms) AS length FROM new_documents)
+            GROUP BY term, object_id
+        """)
+        conn.execute("INSERT INTO object_documents SELECT object_id, len(terms) FROM new_documents")
+    conn.execute("DROP TABLE new_documents")
+
+    # The collection statistics BM25 needs are kept here, so a search does
+    # not scan object_documents, along with the objects version indexed.
+    sorted_postings, indexed_documents, indexed_length = conn.execute(
+        "SELECT sorted_postings, documents, total_length FROM search_index"
+    ).fetchone() or (0, 0, 0)
+    conn.execute("DELETE FROM search_index")
+    conn.execute("""
+        INSERT INTO search_index
+        SELECT ?, ?, ?, COALESCE((SELECT version FROM table_versions WHERE table_name = 'objects'), 0)
+    """, (sorted_postings, indexed_documents + documents, indexed_length + total_length))
+
+
+def prune_search_index(conn):
+    # Removes the postings of objects no longer in the table, and their
+    # share of the collection statistics.
+    conn.execute("""
+        CREATE OR REPLACE TEMP TABLE removed_documents AS
+        SELECT d.object_id, d.length
+        FROM object_documents d
+        ANTI JOIN objects o ON o.id = d.object_id
+    """)
+    documents, length = conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM removed_documents").fetchone()
+    if documents:
+        postings = conn.execute("DELETE FROM object_terms WHERE object_id IN (SELECT object_id FROM removed_documents)").fetchone()[0]
+        conn.execute("DELETE FROM object_documents WHERE object_id IN (SELECT object_id FROM removed_documents)")
+        conn.execute("""
+            UPDATE search_index
+            SET documents = documents - ?, total_length = total_length - ?, sorted_postings = greatest(sorted_postings - ?, 0)
+        """, (documents, length, postings))
+    conn.execute("DROP TABLE removed_documents")
+    return documents
+
+
+@track_db
+def compact_search_index(db_path="users.duckdb"):
+    # Postings are looked up by term through DuckDB's min/max zone maps,
+    # which only skip row groups while the table is sorted by term. Inserts
+    # append unsorted postings; once they exceed search.compact_ratio of
+    # the sorted part, the table is rewritten in order. This runs after the
+    # insert has committed, in its own transaction, and the threshold is
+    # checked read-only first, so most imports never take the write lock
+    # for it. Returns whether the postings were rewritten.
+    def needs_compaction(conn):
+        total, sorted_postings = conn.execute("""
+            SELECT (SELECT COUNT(*) FROM object_terms), (SELECT MAX(sorted_postings) FROM search_index)
+        """).fetchone()
+        return total > (sorted_postings or 0) * (1 + config["search"]["compact_ratio"]), total
+
+    with connection(db_path, read_only=True) as conn:
+        needed, _ = needs_compaction(conn)
+    if not needed:
+        return False
+    with connection(db_path) as conn:
+        # Checked again: another import may have compacted meanwhile.
+        needed, total = needs_compaction(conn)
+        if needed:
+            conn.execute("CREATE OR REPLACE TABLE object_terms AS SELECT * FROM object_terms ORDER BY term, object_id")
+            conn.execute("UPDATE search_index SET sorted_postings = ?", (total,))
+    return needed
+
+
+@track_db
+def build_search_index(db_path="users.duckdb"):
+    # Indexes objects stored before search existed and drops those deleted
+    # from the table. Only runs when the index lags the objects table
+    # version or count, so a restart with an up to date index costs one
+    # read.
+    with connection(db_path, read_only=True) as conn:
+        lagging = conn.execute("""
+            SELECT COALESCE((SELECT version FROM table_versions WHERE table_name = 'objects'), 0)
+                IS DISTINCT FROM (SELECT MAX(objects_version) FROM search_index)
+            OR (SELECT COUNT(*) FROM objects) IS DISTINCT FROM (SELECT MAX(documents) FROM search_index)
+        """).fetchone()[0]
+    if lagging:
+        with connection(db_path) as conn:
+            prune_search_index(conn)
+            index_objects(conn)
+    compact_search_index(db_path)
+    return lagging
+
+
+@track_db
 def add_object(entity_id, db_path="users.duckdb"):
     entity_data = get_entity_data(entity_id)
     if entity_data:
-        conn = duckdb.connect(db_path)
-        
         entity = entity_data[0]
         label_value = entity.get("label")
-        alt_label_value = entity.get("alt_label")
-        description_value = entity.get("description")
-        date_value = entity.get("date")
-        latitude_value = entity.get("latitude")
-        longitude_value = entity.get("longitude")
-        property_value = entity.get("property")
-        official_site_value = entity.get("official_site")
-        viaf_value = entity.get("viaf")
-        
         if entity_id and label_value:
-            
-            conn.execute('''
-            INSERT OR IGNORE INTO objects (
-                id, wikidata_id, label, alt_label, description, date, latitude, longitude, property, official_site, viaf
-            ) VALUES (nextval('seq_id'), ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                entity_id,
-                label_value,
-                alt_label_value or None,
-                description_value or None,
-                date_value or None,
-                latitude_value or None, 
-                longitude_value or None, 
-                property_value or None, 
-                official_site_value or None, 
-                viaf_value or None
-            ))
+            with connection(db_path) as conn:
+                insert_objects(conn, [(entity_id, entity)])
+            compact_search_index(db_path)
             print(f"Added object: {entity_id} with label: {label_value}")
-            conn.commit()
-            conn.close()
         else:
             print(f"Missing data for entity {entity_id}.")
 
 
+@track_db
+def add_objects(entity_ids, db_path="users.duckdb", chunk_size=None, endpoint_url=None):
+    # Resolves many QIDs with one VALUES query per chunk and inserts all of
+    # them in a single transaction. Returns the outcome for every ID.
+    chunk_size = chunk_size or config["entity"]["chunk_size"]
+    report = {}
+    pending = []
+    for entity_id in entity_ids:
+        entity_id = entity_id.strip().upper()
+        if not ENTITY_ID.match(entity_id):
+            report[entity_id] = "Invalid Wikidata ID"
+        elif entity_id not in pending:
+            pending.append(entity_id)
+
+    with connection(db_path, read_only=True) as conn:
+        existing = {row[0] for row in conn.execute("""
+            SELECT wikidata_id
+            FROM objects
+            WHERE list_contains(?, wikidata_id)
+        """, (pending,)).fetchall()}
+    for entity_id in pending:
+        if entity_id in existing:
+            report[entity_id] = "Already present"
+    pending = [entity_id for entity_id in pending if entity_id not in existing]
+
+    entities = []
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        try:
+            found, errors = get_entities_data(chunk, endpoint_url)
+        except Exception as e:
+            for entity_id in chunk:
+                report[entity_id] = f"Query failed: {e}"
+            continue
+        for entity_id in chunk:
+            entity = found.get(entity_id)
+            if entity_id in errors:
+                report[entity_id] = errors[entity_id]
+            elif not entity or not entity.get("label"):
+                report[entity_id] = "Not found or missing label"
+            else:
+                entities.append((entity_id, entity))
+
+    if entities:
+        with connection(db_path) as conn:
+            insert_objects(conn, entities)
+        compact_search_index(db_path)
+        for entity_id, _ in entities:
+            report[entity_id] = "Added"
+    print(f"Imported {len(entities)} of {len(report)} objects.")
+    return report
+
+
+def get_risk_headings():
+    return [risk["heading"] for risk in config["risk"].values() if isinstance(risk, dict)]
+
+
+@track_db
+def set_risk_scores(scores, db_path="users.duckdb"):
+    # scores is a long frame with wikidata_id, heading and value columns.
+    # Library API for loading assessments from scripts; the app itself
+    # has no score input yet.
+    with connection(db_path) as conn:
+        conn.register("score_data", scores[["wikidata_id", "heading", "value"]])
+        conn.execute("""
+            INSERT OR REPLACE INTO risk_scores
+            SELECT wikidata_id, heading, CAST(value AS INTEGER) FROM score_data
+        """)
+        conn.unregister("score_data")
+        bump_table_version(conn, "risk_scores")
+
+
+@track_db
+def get_risk_scores(wikidata_ids=None, db_path="users.duckdb"):
+    # One row per object and one integer column per configured risk heading;
+    # objects without a score for a heading get 0.
+    headings = get_risk_headings()
+    columns = ", ".join(
+        f"COALESCE(MAX(value) FILTER (WHERE heading = ?), 0) AS \"{heading}\""
+        for heading in headings
+    )
+    where = "WHERE list_contains(?, wikidata_id)" if wikidata_ids is not None else ""
+    params = list(headings)
+    if wikidata_ids is not None:
+        params.append(list(wikidata_ids))
+    with connection(db_path, read_only=True) as conn:
+        result = conn.execute(f"""
+            SELECT wikidata_id, {columns}
+            FROM risk_scores
+            {where}
+            GROUP BY wikidata_id
+        """, params).fetchdf()
+    return result.set_index("wikidata_id")
+
+
+@track_db
+def get_object_locations(db_path="users.duckdb"):
+    with connection(db_path, read_only=True) as conn:
+        result = conn.execute("""
+            SELECT wikidata_id, TRY_CAST(latitude AS DOUBLE) AS latitude, TRY_CAST(longitude AS DOUBLE) AS longitude
+            FROM objects
+        """).fetchdf()
+    return result
+
+
+@track_db
 def get_objects(db_path="users.duckdb"):
-    conn = duckdb.connect(db_path)
-    result = conn.execute("SELECT * FROM objects").fetchdf()
-    conn.close()
+    with connection(db_path, read_only=True) as conn:
+        result = conn.execute("SELECT * FROM objects").fetchdf()
+    return result
+
+
+@track_db
+def get_objects_page(sort_by="id", descending=False, filters=None, after=None, before=None, limit=50, db_path="users.duckdb"):
+    # One page of the objects table for the object grid. Sorting, filtering
+    # and paging all run in DuckDB: filters maps columns to substrings that
+    # must appear in them (case-insensitive), and pages are keyset paginated
+    # on (sort key, id), so a deep page costs the same as the first one.
+    # after and before take the "last" or "first" key of the current page.
+    if sort_by not in OBJECT_TABLE_COLUMNS:
+        raise ValueError(f"Unknown object column: {sort_by}")
+    if sort_by in ("id", "wikidata_id"):
+        sort_key = f"\"{sort_by}\""
+    elif sort_by in NUMERIC_OBJECT_COLUMNS:
+        sort_key = f"COALESCE(\"{sort_by}\", '-infinity'::DOUBLE)"
+    else:
+        sort_key = f"COALESCE(\"{sort_by}\", '')"
+
+    where = []
+    params = []
+    for column, text in (filters or {}).items():
+        if column not in OBJECT_TABLE_COLUMNS:
+            raise ValueError(f"Unknown object column: {column}")
+        if text:
+            where.append(f"contains(lower(CAST(\"{column}\" AS VARCHAR)), lower(?))")
+            params.append(text)
+    count_where = f"WHERE {' AND '.join(where)}" if where else ""
+    count_params = list(params)
+
+    # Pages before the cursor are read in reverse order and flipped back.
+    backward = before is not None
+    ascending = descending == backward
+    cursor = before if backward else after
+    if cursor is not None:
+        where.append(f"({sort_key}, id) {'>' if ascending else '<'} (?, ?)")
+        params.extend(cursor)
+    direction = "ASC" if ascending else "DESC"
+    page_where = f"WHERE {' AND '.join(where)}" if where else ""
+
+    with connection(db_path, read_only=True) as conn:
+        # The page is chosen on the sort key and id alone; only its own rows
+        # are then read in full, by primary key.
+        keys = conn.execute(f"""
+            SELECT {sort_key} AS sort_key, id
+            FROM objects
+            {page_where}
+            ORDER BY sort_key {direction}, id {direction}
+            LIMIT ?
+        """, params + [limit + 1]).fetchall()
+        more = len(keys) > limit
+        keys = keys[:limit]
+        if backward:
+            keys.reverse()
+        ids = [object_id for _, object_id in keys]
+        data = conn.execute("""
+            SELECT o.*
+            FROM (SELECT unnest(?) AS id) AS page
+            JOIN objects o USING (id)
+        """, (ids,)).fetchdf()
+        total = conn.execute(f"SELECT COUNT(*) FROM objects {count_where}", count_params).fetchone()[0]
+
+    data = data.set_index("id").loc[ids].reset_index()
+    return {
+        "data": data,
+        "total": total,
+        "first": keys[0] if keys else None,
+        "last": keys[-1] if keys else None,
+        "has_previous": more if backward else after is not None,
+        "has_next": True if backward else more,
+    }
+
+
+@track_db
+def search_objects(query, limit=None, db_path="users.duckdb"):
+    # Objects ranked by BM25 over their label, alternative label,
+    # description and property. Query terms match indexed terms exactly,
+    # except the last, which also matches as a prefix so results show up
+    # while a word is still being typed; a term only reached as a prefix
+    # counts for search.prefix_weight of an exact one.
+    settings = config["search"]
+    limit = limit or settings["limit"]
+    with connection(db_path, read_only=True) as conn:
+        terms = conn.execute(f"SELECT {SEARCH_TERMS.format('?')}", (query,)).fetchone()[0]
+        if not terms:
+            return pd.DataFrame(columns=SEARCH_RESULT_COLUMNS)
+        last = terms[-1]
+        exact = [term for term in dict.fromkeys(terms[:-1]) if term != last]
+
+        # One range lookup per term rather than an IN list or OR, so each
+        # can be answered from the zone maps of the sorted postings.
+        lookups = ["SELECT *, 1.0 AS weight FROM object_terms WHERE term = ?"] * len(exact)
+        lookups.append("SELECT *, CASE WHEN term = ? THEN 1.0 ELSE ? END AS weight FROM object_terms WHERE term >= ? AND term < ?")
+        params = [*exact, last, settings["prefix_weight"], last, last + "{"]
+
+        # The matches are materialized once and scored in SQL; the objects
+        # themselves are only read for the top hits, by primary key.
+        result = conn.execute(f"""
+            WITH matches AS MATERIALIZED (
+                {" UNION ALL ".join(lookups)}
+            ),
+            term_documents AS (
+                SELECT term, COUNT(*) AS documents
+                FROM matches
+                GROUP BY term
+            ),
+            ranked AS (
+                SELECT m.object_id, SUM(
+                    m.weight * ln(1 + (c.documents - t.documents + 0.5) / (t.documents + 0.5))
+                    * m.frequency * (? + 1)
+                    / (m.frequency + ? * (1 - ? + ? * m.length * c.documents / c.total_length))
+                ) AS score
+                FROM matches m
+                JOIN term_documents t USING (term)
+                CROSS JOIN search_index c
+                GROUP BY m.object_id
+                ORDER BY score DESC, m.object_id
+                LIMIT ?
+            )
+            SELECT o.wikidata_id, o.label, o.description, o.latitude, o.longitude, r.score
+            FROM ranked r
+            JOIN objects o ON o.id = r.object_id
+            ORDER BY r.score DESC, r.object_id
+        """, params + [settings["k1"], settings["k1"], settings["b"], settings["b"], limit]).fetchdf()
     return result
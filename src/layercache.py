@@ -0,0 +1,117 @@
+import json
+import threading
+from collections import OrderedDict
+from prometheus_client import Gauge
+from src.metrics import cache_collector
+from src.config import config
+
+
+# Rough in-memory footprint of a parsed GeoJSON dict relative to its
+# serialized text; only used to charge pre-parsed entries against the budget.
+PARSED_SIZE_FACTOR = 4
+
+
+class LayerCache:
+    """
+    Process-wide LRU of reprojected GeoJSON layers, keyed by table and
+    checked against the table version so a re-upload is never served stale.
+    An entry may also hold the (minx, miny, maxx, maxy) bounds of its
+    features, in feature order, for viewport queries on the same data.
+
+    Parsed layers are handed out as the cached dicts themselves, shared by
+    every session and thread: callers must treat them, their features and
+    the bounds as read-only, and copy before changing anything.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or config["cache"]["layers_max_mb"] * 1024 * 1024
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key, version, parsed=False, with_bounds=False):
+        # With with_bounds, returns (layer, bounds) from the same entry, or
+        # None if the entry has no bounds.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["version"] != version or (with_bounds and entry["bounds"] is None):
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            if parsed and entry["data"] is None:
+                entry["data"] = json.loads(entry["json"])
+                self._resize(entry)
+            return self._result(entry, parsed, with_bounds)
+
+    def put(self, key, version, payload, parsed=False, bounds=None, with_bounds=False):
+        entry = {
+            "version": version,
+            "json": payload,
+            "data": json.loads(payload) if parsed else None,
+            "bounds": bounds,
+            "size": 0,
+        }
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = entry
+            self._resize(entry)
+            return self._result(entry, parsed, with_bounds)
+
+    def invalidate(self, prefix):
+        # Drops every entry whose key starts with prefix, e.g. all zoom
+        # levels of one table.
+        with self._lock:
+            for key in [k for k in self._entries if k[:len(prefix)] == prefix]:
+                self._discard(key)
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["max_bytes"] = self.max_bytes
+        return stats
+
+    def _result(self, entry, parsed, with_bounds):
+        layer = entry["data"] if parsed else entry["json"]
+        return (layer, entry["bounds"]) if with_bounds else layer
+
+    def _resize(self, entry):
+        size = len(entry["json"])
+        if entry["data"] is not None:
+            size += len(entry["json"]) * PARSED_SIZE_FACTOR
+        if entry["bounds"] is not None:
+            size += entry["bounds"].nbytes
+        self._bytes += size - entry["size"]
+        entry["size"] = size
+        # entry is the most recently used, so it is only dropped, after all
+        # the others, when it alone exceeds the budget; the caller still gets
+        # its data.
+        while self._bytes > self.max_bytes and self._entries:
+            _, old_entry = self._entries.popitem(last=False)
+            self._bytes -= old_entry["size"]
+            self._stats["evictions"] += 1
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= entry["size"]
+        return True
+
+
+layer_cache = LayerCache()
+cache_collector.register("layers", layer_cache.get_stats)
+
+# Memory held by parsed layers in this worker; shared by every session, so
+# it follows the number of distinct layers and zoom levels viewed.
+LAYER_CACHE_BYTES = Gauge("risk_atlas_layer_cache_bytes", "Estimated bytes of layer data shared by all sessions")
+LAYER_CACHE_BYTES.set_function(lambda: layer_cache.get_stats()["bytes"])
@@ -1,29 +1,68 @@
-from ipyleaflet import Map, GeoJSON, GeoData, ZoomControl, FullScreenControl, LegendControl, MarkerCluster, Marker, AwesomeIcon, Popup, LayerGroup
-import ipywidgets as widgets
-from ipywidgets.widgets.widget_string import HTML
-from shapely.geometry import Point, Polygon, shape
-from bs4 import BeautifulSoup
-import os
 import json
-import geopandas as gpd
-import tomli
-import cProfile, pstats, io
-from pstats import SortKey
-
-
-with open("config.toml", mode="rb") as fp:
-    config = tomli.load(fp)
+import numpy as np
+import pandas as pd
+from functools import partial
+from string import Formatter
+from src.spatialindex import SpatialIndex
+from src.objectlayer import ObjectLayer
+from src.metrics import track_map, MAP_LAYERS
+from src.config import config
+
+
+# ipyleaflet is imported where widgets are created rather than at module
+# level, so workers can serve the login page before it has been loaded.
+
+
+# Parsed once into (literal, field, format_spec, conversion) parts.
+POPUP_TEMPLATE = list(Formatter().parse(config["map"]["popup_content"]))
+
+
+def render_popups(data):
+    # Fills the popup template for every row of the objects frame at once,
+    # one template field (column) at a time. Missing values render empty.
+    popups = pd.Series("", index=data.index, dtype=str)
+    for literal, field, format_spec, conversion in POPUP_TEMPLATE:
+        popups = popups + literal
+        if field is None:
+            continue
+        values = data[field].astype(object)
+        values = values.where(values.notna(), "")
+        if conversion == "r":
+            values = values.map(repr)
+        if format_spec:
+            values = values.map(lambda value: format(value, format_spec))
+        popups = popups + values.astype(str)
+    return popups.to_numpy()
 
 
 class MapManager:
+    # layer_loader returns parsed GeoJSON shared through layer_cache; it is
+    # only ever assigned to widgets, which copy it before styling, and never
+    # changed in place.
 
-    def __init__(self):
+    def __init__(self, layer_loader=None):
         self.map = None
+        self.layers = {}
+        self.layer_versions = {}
+        self.layer_views = {}
         self.active_layers = []
-        self.points_in_geometry = set()
+        self.update_stats = {}
+        self.objects = None
+        self.markers = []
+        self.popups = None
+        self.popup = None
+        self.icons = {}
+        self.object_layer = None
+        self.marker_cluster = None
+        self.objects_version = None
+        self.spatial_index = None
+        self.spatial_index_key = None
+        self.layer_loader = layer_loader
+        self.loaded_view = None
 
 
     def create_map(self):
+        from ipyleaflet import Map
         self.map = Map(
             zoom = config["map"]["zoom"],
             center = (
@@ -33,28 +72,116 @@ class MapManager:
             zoom_control = False
             )
         self.map.layout.height = '750px'
+        self.map.observe(self.on_view_change, names=["bounds", "zoom"])
         self.set_map_controls()
         return self.map
 
-    def update_map(self, layers):
-        self.clear_map()
-        for layer in layers:
-            self.add_layer(layer)
-
-    def add_layer(self, data):
-        data = json.loads(data)
-        layer = GeoJSON(data=data)
+    @track_map
+    def update_map(self, table_names, versions=None):
+        # Layers stay loaded per table once added: unchecking one only hides
+        # it, and checking it again shows it without a reload unless its
+        # table version or the loaded view changed in the meantime.
+        # versions maps table names to their current data version.
+        versions = versions or {}
+        view = self.loaded_view if self.covers_view() else self.get_view()
+        stats = {"added": 0, "removed": 0, "reused": 0, "reloaded": 0}
+        for name, layer in self.layers.items():
+            if name not in table_names and layer.visible:
+                layer.visible = False
+                stats["removed"] += 1
+        for name in table_names:
+            if name not in self.layers:
+                self.add_layer(self.layer_loader(name, **view), name)
+                stats["added"] += 1
+            elif self.layer_versions[name] != versions.get(name) or self.layer_views[name] != view:
+                self.layers[name].data = self.layer_loader(name, **view)
+                self.layers[name].visible = True
+                stats["reloaded"] += 1
+            else:
+                self.layers[name].visible = True
+                stats["reused"] += 1
+            self.layer_versions[name] = versions.get(name)
+            self.layer_views[name] = view
+        self.active_layers = [self.layers[name] for name in table_names]
+        self.loaded_view = view or None
+        self.update_stats = stats
+        for outcome, count in stats.items():
+            MAP_LAYERS.labels(outcome).inc(count)
+        return stats
+
+    def add_layer(self, data, name=""):
+        from ipyleaflet import GeoJSON
+        if isinstance(data, str):
+            data = json.loads(data)
+        layer = GeoJSON(data=data, name=name)
         layer.visible = True
         self.map.add(layer)
-        self.active_layers.append(layer)
+        self.layers[name] = layer
             
     def clear_map(self):
-        for layer in self.active_layers:
+        for layer in self.layers.values():
             self.map.remove(layer)
+        self.layers = {}
+        self.layer_versions = {}
+        self.layer_views = {}
         self.active_layers = []
 
 
+    def get_view(self):
+        # The bounds trait stays empty until the browser has drawn the map;
+        # callers then fall back to loading whole layers at the current zoom.
+        if not self.map:
+            return {}
+        if not self.map.bounds:
+            return {"zoom": self.map.zoom}
+        (south, west), (north, east) = self.map.bounds
+        # Load a margin around the viewport so small pans need no reload.
+        pad_x = (east - west) * config["map"]["viewport_padding"]
+        pad_y = (north - south) * config["map"]["viewport_padding"]
+        return {
+            "bbox": (west - pad_x, south - pad_y, east + pad_x, north + pad_y),
+            "zoom": self.map.zoom,
+        }
+
+    @track_map
+    def fit_bounds(self, extent):
+        # extent is (west, south, east, north) in EPSG:4326; the layers are
+        # reloaded for the new view by on_view_change.
+        west, south, east, north = extent
+        self.map.fit_bounds([[south, west], [north, east]])
+
+    def covers_view(self):
+        # Whether the loaded view still contains what the map shows.
+        if not self.loaded_view:
+            return False
+        if not self.map.bounds or "bbox" not in self.loaded_view:
+            return self.loaded_view == self.get_view()
+        (south, west), (north, east) = self.map.bounds
+        minx, miny, maxx, maxy = self.loaded_view["bbox"]
+        return (
+            self.loaded_view["zoom"] == self.map.zoom
+            and minx <= west and miny <= south and maxx >= east and maxy >= north
+        )
+
+    @track_map
+    def on_view_change(self, change):
+        # Only visible layers follow the view; hidden ones are reloaded
+        # by update_map when they are shown again.
+        if not self.map.bounds or self.covers_view():
+            return
+        view = self.get_view()
+        self.loaded_view = view
+        if self.object_layer is not None:
+            self.object_layer.render(**view)
+        if self.layer_loader is None:
+            return
+        for layer in self.active_layers:
+            layer.data = self.layer_loader(layer.name, **view)
+            self.layer_views[layer.name] = view
+
+
     def set_map_controls(self):
+        from ipyleaflet import ZoomControl, FullScreenControl, LegendControl
         zoom_control = ZoomControl(position='topright')
         fullscreen_control = FullScreenControl(position='topright')
         legend_control = LegendControl(
@@ -100,94 +227,151 @@ class MapManager:
             self.map.add(layer)'''
 
 
+    @track_map
+    def set_objects(self, data):
+        # Replaces the objects shown on the map after they changed.
+        if self.marker_cluster is not None:
+            self.map.remove(self.marker_cluster)
+            self.marker_cluster = None
+        if self.object_layer is not None:
+            self.map.remove(self.object_layer.layer)
+            self.object_layer = None
+        if self.popup is not None:
+            self.popup.close_popup()
+        self.add_objects(data)
+
+
+    @track_map
+    def add_objects(self, data):
+        # Small object sets get one clickable marker each; above
+        # map.objects.marker_limit they are drawn as a single clustered layer.
+        if len(data) <= config["map"]["objects"]["marker_limit"]:
+            self.add_markers(self.generate_markers(data))
+            return
+        self.objects = data
+        self.popups = render_popups(data)
+        self.markers = []
+        self.object_layer = ObjectLayer(self.map, data, self.__get_color, self.open_popup)
+        self.object_layer.render(**self.get_view())
+        self.map.add(self.object_layer.layer)
+
+
     def generate_markers(self, data):
+        from ipyleaflet import Marker, MarkerCluster
+        # Popup HTML is rendered for every object up front, column-wise; the
+        # popup widget itself is shared and only filled in on marker click.
+        self.objects = data
+        self.popups = render_popups(data)
+        icon = self.get_icon(config["map"]["legend"]["color"]["unscored"])
         markers = []
-        for i, row in data.iterrows():
-            point = (row['latitude'], row['longitude'])
-            point_color = 'lightblue'
-            popup = self.add_popup(row, point)
+        for i, (label, latitude, longitude) in enumerate(zip(data["label"], data["latitude"], data["longitude"])):
             marker = Marker(
-                name = row['label'],
-                location = point,
-                icon = AwesomeIcon(
-                    name="university",
-                    marker_color=point_color,
-                    icon_color="black",
-                ),
-                draggable = False,
-                popup = popup
+                name = label,
+                location = (latitude, longitude),
+                icon = icon,
+                draggable = False
             )
+            marker.on_click(partial(self.open_popup, i))
             markers.append(marker)
+        self.markers = markers
         marker_cluster = MarkerCluster(markers=markers)
         return marker_cluster
 
-    
-    def add_popup(self, row, point):
-        popup_template = config['map']['popup_content']
-        popup_content = eval(f"f'''{popup_template}'''")
-        popup_html = HTML(
-            value = popup_content,
-        )
-        popup = Popup(
-            location=point,
-            child=popup_html,
-            min_width=1000,
-        )
-        return popup
+
+    def get_icon(self, color):
+        from ipyleaflet import AwesomeIcon
+        # One icon widget per colour, shared by every marker of that colour.
+        if color not in self.icons:
+            self.icons[color] = AwesomeIcon(
+                name="university",
+                marker_color=color,
+                icon_color="black",
+            )
+        return self.icons[color]
+
+
+    def open_popup(self, index, **kwargs):
+        from ipyleaflet import Popup
+        from ipywidgets import HTML
+        location = (self.objects["latitude"].iat[index], self.objects["longitude"].iat[index])
+        if self.popup is None:
+            self.popup = Popup(
+                location=location,
+                child=HTML(value=self.popups[index]),
+                min_width=1000,
+            )
+            self.map.add(self.popup)
+        else:
+            self.popup.child.value = self.popups[index]
+            self.popup.open_popup(location)
+
+
+    @track_map
+    def focus_object(self, wikidata_id, latitude, longitude, zoom=None):
+        # Centres the map on a search hit and opens its popup when the
+        # object is among those drawn; the layers follow via on_view_change.
+        self.map.center = (latitude, longitude)
+        self.map.zoom = zoom or config["search"]["zoom"]
+        if self.objects is None:
+            return
+        matches = np.flatnonzero(self.objects["wikidata_id"].to_numpy() == wikidata_id)
+        if len(matches):
+            self.open_popup(int(matches[0]))
 
 
     def add_markers(self, marker_cluster):
+        self.marker_cluster = marker_cluster
         self.map.add(marker_cluster)
 
 
-    '''
-    def update_markers(self, marker_cluster):
-        for marker in marker_cluster.markers:
-            highest_risk_value = self.__get_highest_risk_value(marker)
-            point_color = self.__get_color(highest_risk_value)
-            marker.icon = Icon(
-                icon_url=f'https://raw.githubusercontent.com/pointhi/leaflet-color-markers/master/img/marker-icon-{point_color}.png'
-            )
-    '''
+    @track_map
+    def update_markers(self, highest_risk):
+        # highest_risk is RiskAnalytics.get_highest_risk for the active
+        # layers, computed on whole full-resolution layers, so colours do
+        # not depend on the loaded viewport or its simplification level.
+        if self.objects is None or self.objects.empty:
+            highest_risk_values = np.zeros(0, dtype=int)
+        else:
+            highest_risk_values = highest_risk.reindex(self.objects["wikidata_id"]).fillna(0).to_numpy(dtype=int)
+        if self.object_layer is not None:
+            self.object_layer.set_risk(highest_risk_values)
+            return
+        colors = self.__get_color(highest_risk_values)
+        for marker, color in zip(self.markers, colors.tolist()):
+            icon = self.get_icon(color)
+            if marker.icon is not icon:
+                marker.icon = icon
+
+
+    def get_spatial_index(self):
+        # Rebuilt only when the set of displayed layer data changes, i.e.
+        # after a layer toggle or a viewport reload.
+        key = tuple(id(layer.data) for layer in self.active_layers)
+        if key != self.spatial_index_key:
+            self.spatial_index = SpatialIndex([layer.data for layer in self.active_layers])
+            self.spatial_index_key = key
+        return self.spatial_index
 
 
     def is_in_geometry(self, point):
-        for layer in self.active_layers:
-            layer_data = layer.data
-            for feature in layer_data["features"]:
-                geometry = shape(feature['geometry'])
-                if geometry.contains(point):
-                    self.points_in_geometry.add(point)
-                    return True
-
-
-    def __get_highest_risk_value(self, marker):
-        highest_risk = 0
-        html_value = marker.popup.child.value
-        soup = BeautifulSoup(html_value, 'html.parser')
-        point = Point(marker.location[1], marker.location[0])
-        if self.is_in_geometry(point):
-            for layer in self.active_layers:
-                layer_data = layer.data
-                for feature in layer_data["features"]:
-                    risk_header = feature['properties']['name']
-                    risk_value = soup.find(attrs={"data-id": risk_header}).get('data-value')
-                    if risk_value:
-                        if int(risk_value) > highest_risk:
-                            highest_risk = int(risk_value)
-        return highest_risk
-
-
-    def __get_color(self, risk_value):
-        if risk_value > config["map"]["legend"]["value"]["high"]:
-            return config["map"]["legend"]["color"]["high"]
-        elif config["map"]["legend"]["value"]["medium"] < risk_value <= config["map"]["legend"]["value"]["high"]:
-            return config["map"]["legend"]["color"]["medium"]
-        elif config["map"]["legend"]["value"]["low"] <= risk_value <= config["map"]["legend"]["value"]["medium"]:
-            return config["map"]["legend"]["color"]["low"]
-        else:
-            return config["map"]["legend"]["color"]["neutral"]
-
+        return self.get_spatial_index().contains(point)
+
+
+    def __get_color(self, risk_values):
+        legend = config["map"]["legend"]
+        return np.select(
+            [
+                risk_values > legend["value"]["high"],
+                risk_values > legend["value"]["medium"],
+                risk_values >= legend["value"]["low"],
+            ],
+            [
+                legend["color"]["high"],
+                legend["color"]["medium"],
+                legend["color"]["low"],
+            ],
+            default=legend["color"]["neutral"]
+        )
 
 
     '''def find_highest_risk(df):
@@ -216,8 +400,12 @@ class MapManager:
 
 
     def count_points_in_geometry(self):
-        count = len(self.points_in_geometry)
-        return count
+        if self.objects is None or self.objects.empty or not self.active_layers:
+            return 0
+        return self.get_spatial_index().count_points_within(
+            pd.to_numeric(self.objects["longitude"], errors="coerce"),
+            pd.to_numeric(self.objects["latitude"], errors="coerce")
+        )
 
     
     def update_value_boxes(self, box):
@@ -0,0 +1,204 @@
+import cProfile
+import functools
+import inspect
+import os
+import random
+import threading
+import time
+import pandas as pd
+import pyarrow as pa
+from prometheus_client import Counter, Histogram, make_asgi_app
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+from src.routing import with_routes
+from src.config import config
+
+
+DB_SECONDS = Histogram("risk_atlas_db_call_seconds", "Latency of dbfunctions calls", ["function"])
+DB_ROWS = Counter("risk_atlas_db_rows", "Rows returned by dbfunctions calls", ["function"])
+DB_BYTES = Counter("risk_atlas_db_bytes", "Bytes returned by dbfunctions calls", ["function"])
+SPARQL_SECONDS = Histogram(
+    "risk_atlas_sparql_seconds", "Latency of SPARQL round trips", ["outcome"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+SPARQL_BINDINGS = Counter("risk_atlas_sparql_bindings", "Bindings received from SPARQL endpoints")
+REACTIVE_SECONDS = Histogram("risk_atlas_reactive_seconds", "Latency of reactive effects, calcs and renders", ["name"])
+MAP_SECONDS = Histogram("risk_atlas_map_update_seconds", "Latency of map widget updates", ["method"])
+MAP_LAYERS = Counter("risk_atlas_map_layers", "Layers added, removed, reused or reloaded by map updates", ["outcome"])
+PROFILES = Counter("risk_atlas_profiles", "Sampled profiles written to disk", ["name"])
+
+
+def result_size(result):
+    # (rows, bytes) of a call result, None where it cannot be told cheaply.
+    if isinstance(result, pd.DataFrame):
+        return len(result), int(result.memory_usage(index=False).sum())
+    if isinstance(result, pa.Table):
+        return result.num_rows, result.nbytes
+    if isinstance(result, (str, bytes)):
+        return None, len(result)
+    if isinstance(result, dict) and "features" in result:
+        return len(result["features"]), None
+    if isinstance(result, dict) and isinstance(result.get("data"), pd.DataFrame):
+        return result_size(result["data"])
+    return None, None
+
+
+def timed(histogram, count=False):
+    # Decorator factory: observes the wrapped function's latency in
+    # histogram, labelled by its name, and offers the call to the sampling
+    # profiler. With count, rows and bytes of the result are counted too.
+    def decorator(function):
+        name = function.__name__
+        observe = histogram.labels(name).observe
+
+        def record(start, result):
+            observe(time.perf_counter() - start)
+            if count:
+                rows, size = result_size(result)
+                if rows is not None:
+                    DB_ROWS.labels(name).inc(rows)
+                if size is not None:
+                    DB_BYTES.labels(name).inc(size)
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with profiler(name):
+                    start = time.perf_counter()
+                    result = None
+                    try:
+                        result = await function(*args, **kwargs)
+                        return result
+                    finally:
+                        record(start, result)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with profiler(name):
+                    start = time.perf_counter()
+                    result = None
+                    try:
+                        result = function(*args, **kwargs)
+                        return result
+                    finally:
+                        record(start, result)
+        return wrapper
+    return decorator
+
+
+track_db = timed(DB_SECONDS, count=True)
+track_reactive = timed(REACTIVE_SECONDS)
+track_map = timed(MAP_SECONDS)
+
+
+def track_sparql(function):
+    # Only the network round trip is wrapped; cache lookups are counted by
+    # the sparql cache itself.
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            bindings = function(*args, **kwargs)
+        except Exception:
+            SPARQL_SECONDS.labels("error").observe(time.perf_counter() - start)
+            raise
+        SPARQL_SECONDS.labels("ok").observe(time.perf_counter() - start)
+        SPARQL_BINDINGS.inc(len(bindings))
+        return bindings
+    return wrapper
+
+
+class Profiler:
+    """
+    Opt-in sampling profiler. A share (rate) of the instrumented calls is
+    run under cProfile and dumped to directory as one <name>-<time>-...prof
+    file per call, readable with pstats or snakeviz. Only the outermost sampled call of a
+    thread is profiled, so a sampled effect includes the database calls it
+    makes. A sampled coroutine also records whatever else the event loop
+    runs while it awaits.
+    """
+
+    def __init__(self, rate=None, directory=None):
+        settings = config["metrics"]
+        self.rate = rate if rate is not None else settings["profile_rate"]
+        self.directory = directory or settings["profile_dir"]
+        self._local = threading.local()
+
+    def set_rate(self, rate):
+        self.rate = rate
+
+    def __call__(self, name):
+        if self.rate <= 0 or getattr(self._local, "active", False) or random.random() >= self.rate:
+            return _NOT_SAMPLED
+        return _SampledProfile(self, name)
+
+
+class _SampledProfile:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        self.profiler._local.active = True
+        self.profile.enable()
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+        self.profiler._local.active = False
+        os.makedirs(self.profiler.directory, exist_ok=True)
+        file_name = f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{random.randrange(16**6):06x}.prof"
+        self.profile.dump_stats(os.path.join(self.profiler.directory, file_name))
+        PROFILES.labels(self.name).inc()
+        return False
+
+
+class _NotSampled:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOT_SAMPLED = _NotSampled()
+profiler = Profiler()
+
+
+class CacheCollector:
+    """
+    Exposes the hit, miss and eviction counters the in-process caches
+    already keep, read from their get_stats() at scrape time.
+    """
+
+    def __init__(self):
+        self.sources = {}
+
+    def register(self, name, get_stats):
+        self.sources[name] = get_stats
+
+    def collect(self):
+        counters = {
+            key: CounterMetricFamily(f"risk_atlas_cache_{key}", f"Cache {key}", labels=["cache"])
+            for key in ("hits", "misses", "evictions")
+        }
+        entries = GaugeMetricFamily("risk_atlas_cache_entries", "Entries held by each cache", labels=["cache"])
+        for name, get_stats in list(self.sources.items()):
+            try:
+                stats = get_stats()
+            except Exception as e:
+                print(f"Could not read {name} cache stats: {e}")
+                continue
+            for key, family in counters.items():
+                family.add_metric([name], stats.get(key, 0))
+            entries.add_metric([name], stats.get("entries", 0))
+        yield from counters.values()
+        yield entries
+
+
+cache_collector = CacheCollector()
+REGISTRY.register(cache_collector)
+
+
+def with_metrics(app, path=None):
+    # Serves the Prometheus exposition format on path.
+    return with_routes(app, {path or config["metrics"]["path"]: make_asgi_app()})
@@ -0,0 +1,37 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.dbfunctions import add_objects
+from src.config import config
+
+
+class ObjectIngestor:
+    """
+    Runs object imports (SPARQL round trips plus the DuckDB write) on a
+    small worker pool shared by every session, so the Shiny event loop
+    never blocks on them. At most max_workers imports run at once and at
+    most max_queued wait behind them.
+    """
+
+    def __init__(self, max_workers=None, max_queued=None):
+        settings = config["entity"]["ingest"]
+        self.max_workers = max_workers or settings["workers"]
+        self.max_queued = max_queued or settings["max_queued"]
+        self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="object-ingest")
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queued)
+
+    async def ingest(self, entity_ids, db_path="users.duckdb"):
+        if not self._slots.acquire(blocking=False):
+            raise RuntimeError("Too many imports in progress, please try again shortly.")
+        try:
+            future = self.executor.submit(add_objects, entity_ids, db_path)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is freed when the worker finishes, not when the caller
+        # stops waiting, so abandoned imports still count against the limit.
+        future.add_done_callback(lambda _: self._slots.release())
+        return await asyncio.wrap_future(future)
+
+
+object_ingestor = ObjectIngestor()
@@ -0,0 +1,111 @@
+import math
+import numpy as np
+from src.metrics import track_map
+from src.config import config
+
+
+class ObjectLayer:
+    """
+    All objects drawn as a single GeoJSON widget instead of one Marker per
+    object. Objects are merged on a screen-pixel grid at the current zoom,
+    and only the cells inside the loaded view are sent, so the payload
+    depends on what is visible rather than on the number of objects. Each
+    cell is coloured by the highest risk of the objects in it.
+    """
+
+    def __init__(self, map, data, color_for, on_object_click=None):
+        from ipyleaflet import GeoJSON
+        # color_for maps an array of risk values to legend colours.
+        # on_object_click(index) is called when a single object is clicked.
+        self.map = map
+        self.longitudes = data["longitude"].to_numpy(dtype=float)
+        self.latitudes = data["latitude"].to_numpy(dtype=float)
+        self.labels = data["label"].astype(object).to_numpy()
+        self.wikidata_ids = data["wikidata_id"].to_numpy()
+        self.risk = None
+        self.color_for = color_for
+        self.on_object_click = on_object_click
+        self.zoom = None
+        self.bbox = None
+        self.layer = GeoJSON(
+            data={"type": "FeatureCollection", "features": []},
+            name="objects",
+            point_style={"radius": 6, "weight": 1, "opacity": 1, "fillOpacity": 0.8},
+        )
+        self.layer.on_click(self.on_click)
+
+    @track_map
+    def set_risk(self, values):
+        self.risk = np.asarray(values)
+        self.render(self.zoom, self.bbox)
+
+    @track_map
+    def render(self, zoom=None, bbox=None):
+        self.zoom = zoom
+        self.bbox = bbox
+        self.layer.data = self.aggregate(zoom, bbox)
+
+    def aggregate(self, zoom, bbox=None):
+        # bbox is (west, south, east, north) in EPSG:4326.
+        lons, lats = self.longitudes, self.latitudes
+        mask = np.isfinite(lons) & np.isfinite(lats)
+        if bbox is not None:
+            west, south, east, north = bbox
+            mask &= (lons >= west) & (lons <= east) & (lats >= south) & (lats <= north)
+        index = np.flatnonzero(mask)
+        risk = self.risk if self.risk is not None else np.full(len(lons), -1)
+
+        settings = config["map"]["objects"]
+        if zoom is None or zoom >= settings["cluster_max_zoom"]:
+            cells = np.arange(len(index))
+        else:
+            size = settings["cluster_radius"] * 360 / (256 * 2 ** zoom)
+            keys = np.stack([np.floor(lons[index] / size), np.floor(lats[index] / size)], axis=1)
+            _, cells = np.unique(keys, axis=0, return_inverse=True)
+            cells = cells.ravel()
+
+        count = np.bincount(cells, minlength=cells.max() + 1 if len(cells) else 0)
+        lon = np.bincount(cells, weights=lons[index]) / np.maximum(count, 1)
+        lat = np.bincount(cells, weights=lats[index]) / np.maximum(count, 1)
+        highest = np.full(len(count), -1)
+        np.maximum.at(highest, cells, risk[index])
+        member = np.zeros(len(count), dtype=int)
+        member[cells] = index
+        if self.risk is not None:
+            colors = self.color_for(highest)
+        else:
+            colors = np.full(len(count), config["map"]["legend"]["color"]["unscored"])
+
+        features = []
+        for cell in range(len(count)):
+            color = str(colors[cell])
+            properties = {
+                "count": int(count[cell]),
+                "risk": int(highest[cell]),
+                "style": {
+                    "color": "black",
+                    "fillColor": color,
+                    "radius": min(6 + 2 * math.log2(count[cell]), 24),
+                },
+            }
+            if count[cell] == 1:
+                properties["index"] = int(member[cell])
+                properties["wikidata_id"] = str(self.wikidata_ids[member[cell]])
+                properties["label"] = self.labels[member[cell]]
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [float(lon[cell]), float(lat[cell])]},
+                "properties": properties,
+            })
+        return {"type": "FeatureCollection", "features": features}
+
+    def on_click(self, properties=None, coordinates=None, **kwargs):
+        if properties is None:
+            return
+        if "index" in properties:
+            if self.on_object_click:
+                self.on_object_click(properties["index"])
+        elif coordinates:
+            # Clicking a cluster zooms in on it.
+            self.map.center = coordinates
+            self.map.zoom = min(self.map.zoom + 2, config["map"]["objects"]["cluster_max_zoom"])
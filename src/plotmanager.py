@@ -1,39 +1,90 @@
-import matplotlib.pyplot as plt
+import base64
+import hashlib
 import io
+import threading
+import numpy as np
 import pandas as pd
-import seaborn as sns
-from shinywidgets import output_widget
+from collections import OrderedDict
+from src.config import config
+
 
 class PlotManager:
-    def __init__(self):
-        self.plot = None
-    
-    def create_plot(self):
-        fig, ax = plt.subplots()
-        data = [
-            {
-                'name': 'Oggetto 1',
-                'risk_type': 'earthquake_risk',
-                'risk_value': 2
-            },
-            {
-                'name': 'Oggetto 1',
-                'risk_type': 'flood_risk',
-                'risk_value': 6
-            },
-        ]
-        df = pd.DataFrame(data)
-        # IF NOT EMPTY
-        plt.figure(figsize=(10, 6))
-        ax = sns.barplot(
-            x='risk_value',
-            y='name',
-            hue='risk_type',
-            data=df,
-            palette={'earthquake_risk': 'brown', 'flood_risk': 'blue'})
-            
+    """
+    Risk bar charts rendered to PNG with matplotlib's object-oriented API.
+    Figures are never registered with pyplot, so nothing outlives a render,
+    and finished images are kept in a bounded LRU keyed by a hash of the
+    plotted data, so unchanged data is never drawn twice.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or config["plot"]["cache_entries"]
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def create_plot(self, data):
+        # data is a long frame with name, risk and value columns, as
+        # returned by RiskAnalytics.get_plot_data. Returns PNG bytes.
+        key = self.make_key(data)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self._stats["hits"] += 1
+                return self._cache[key]
+            self._stats["misses"] += 1
+
+        image = self.render(data)
+        with self._lock:
+            self._cache[key] = image
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+                self._stats["evictions"] += 1
+        return image
+
+    def create_plot_uri(self, data):
+        return "data:image/png;base64," + base64.b64encode(self.create_plot(data)).decode()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._cache)
+        return stats
+
+    @staticmethod
+    def make_key(data):
+        digest = hashlib.sha256(",".join(data.columns).encode())
+        digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+
+    def render(self, data):
+        # matplotlib is only imported once a chart is drawn.
+        from matplotlib.figure import Figure
+        settings = config["plot"]
+        figure = Figure(figsize=(settings["width"], settings["height"]), dpi=settings["dpi"])
+        ax = figure.subplots()
         ax.set_title("Combined Risk Values")
         ax.set_xlabel("Risk Value")
         ax.set_ylabel("Object")
-        self.plot = ax
-        return self.plot
+
+        if data.empty:
+            ax.text(0.5, 0.5, "No objects in the active layers", ha="center", va="center", transform=ax.transAxes)
+            ax.set_xticks([])
+            ax.set_yticks([])
+        else:
+            colors = {
+                risk["name"]: risk.get("fill_color")
+                for risk in config["risk"].values() if isinstance(risk, dict)
+            }
+            values = data.pivot_table(index="name", columns="risk", values="value", aggfunc="max", sort=False).fillna(0)
+            positions = np.arange(len(values.index))
+            height = 0.8 / len(values.columns)
+            for i, risk in enumerate(values.columns):
+                ax.barh(positions + i * height, values[risk], height, label=risk, color=colors.get(risk))
+            ax.set_yticks(positions + height * (len(values.columns) - 1) / 2, values.index)
+            ax.invert_yaxis()
+            ax.legend(title="Risk", loc="upper left", bbox_to_anchor=(1, 1))
+
+        figure.tight_layout()
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format="png")
+        return buffer.getvalue()
@@ -1,8 +1,5 @@
-import os, sys, json, tomli
-
-
-with open("config.toml", mode="rb") as fp:
-    config = tomli.load(fp)
+import os, sys, json
+from src.config import config
 
 
 class RiskDataManager():
@@ -0,0 +1,7 @@
+def with_routes(app, routes):
+    # routes maps HTTP paths to the ASGI apps answering them; every other
+    # request, websocket and lifespan event is handed to app unchanged.
+    async def asgi(scope, receive, send):
+        route = routes.get(scope["path"]) if scope["type"] == "http" else None
+        await (route or app)(scope, receive, send)
+    return asgi
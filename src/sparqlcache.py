@@ -0,0 +1,168 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from src.connectionmanager import get_connection_manager
+from src.metrics import cache_collector
+from src.config import config
+
+
+MODES = ("online", "stale-while-revalidate", "offline")
+
+
+class SparqlCacheMiss(LookupError):
+    pass
+
+
+class SparqlCache:
+    """
+    Raw SPARQL bindings persisted in DuckDB, keyed by a hash of the endpoint
+    and the whitespace-normalized query.
+
+    online: expired entries are fetched again before answering.
+    stale-while-revalidate: expired entries are served at once and
+        refreshed in a background thread.
+    offline: only the cache is consulted; a miss raises SparqlCacheMiss.
+
+    Empty results expire after negative_ttl, so a transient empty answer
+    does not hide an entity for the full ttl. Hits only read the table;
+    their access times are kept in memory and written with the next store,
+    which is when they are needed for eviction.
+    """
+
+    def __init__(self, db_path=None, ttl=None, max_entries=None, mode=None, negative_ttl=None):
+        settings = config["entity"]["cache"]
+        self.db_path = db_path or settings["path"]
+        self.ttl = ttl if ttl is not None else settings["ttl_hours"] * 3600
+        self.negative_ttl = negative_ttl if negative_ttl is not None else settings["negative_ttl_hours"] * 3600
+        self.max_entries = max_entries or settings["max_entries"]
+        self.mode = mode or settings["mode"]
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown SPARQL cache mode: {self.mode}")
+        self._ready = False
+        self._refreshing = set()
+        self._accessed = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "refreshes": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(query, endpoint_url):
+        normalized = re.sub(r"\s+", " ", query).strip()
+        return hashlib.sha256(f"{endpoint_url}\n{normalized}".encode()).hexdigest()
+
+    def get(self, query, endpoint_url, fetch):
+        # fetch() performs the actual request and returns the bindings.
+        key = self.make_key(query, endpoint_url)
+        row = self._lookup(key)
+        if row is not None:
+            bindings, fetched_at = row
+            ttl = self.ttl if bindings else self.negative_ttl
+            if self.mode == "offline" or time.time() - fetched_at < ttl:
+                self._count("hits")
+                return bindings
+            if self.mode == "stale-while-revalidate":
+                self._count("stale")
+                self._refresh_in_background(key, fetch)
+                return bindings
+        elif self.mode == "offline":
+            self._count("misses")
+            raise SparqlCacheMiss("Query is not cached and the SPARQL cache is offline.")
+
+        self._count("misses")
+        bindings = fetch()
+        self._store(key, bindings)
+        return bindings
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        with self._connection(read_only=True) as conn:
+            stats["entries"] = conn.execute("SELECT COUNT(*) FROM sparql_cache").fetchone()[0]
+        return stats
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sparql_cache")
+
+    def _connection(self, read_only=False):
+        manager = get_connection_manager(self.db_path)
+        if not self._ready:
+            with manager.connection() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS sparql_cache (
+                        key VARCHAR PRIMARY KEY,
+                        bindings JSON NOT NULL,
+                        fetched_at DOUBLE NOT NULL,
+                        accessed_at DOUBLE NOT NULL
+                    )
+                """)
+            self._ready = True
+        return manager.connection(read_only=read_only)
+
+    def _lookup(self, key):
+        with self._connection(read_only=True) as conn:
+            row = conn.execute("""
+                SELECT bindings, fetched_at
+                FROM sparql_cache
+                WHERE key = ?
+            """, (key,)).fetchone()
+        if row is None:
+            return None
+        with self._lock:
+            self._accessed[key] = time.time()
+        return json.loads(row[0]), row[1]
+
+    def _store(self, key, bindings):
+        now = time.time()
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+        with self._connection() as conn:
+            if accessed:
+                conn.execute("""
+                    UPDATE sparql_cache
+                    SET accessed_at = a.accessed_at
+                    FROM (SELECT unnest(?) AS key, unnest(?) AS accessed_at) a
+                    WHERE sparql_cache.key = a.key
+                """, (list(accessed), list(accessed.values())))
+            conn.execute("""
+                INSERT OR REPLACE INTO sparql_cache VALUES (?, ?, ?, ?)
+            """, (key, json.dumps(bindings), now, now))
+            evicted = conn.execute("""
+                DELETE FROM sparql_cache
+                WHERE key IN (
+                    SELECT key
+                    FROM sparql_cache
+                    ORDER BY accessed_at DESC
+                    OFFSET ?
+                )
+                RETURNING key
+            """, (self.max_entries,)).fetchall()
+        if evicted:
+            self._count("evictions", len(evicted))
+
+    def _refresh_in_background(self, key, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._store(key, fetch())
+                self._count("refreshes")
+            except Exception as e:
+                print(f"Background SPARQL refresh failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+
+sparql_cache = SparqlCache()
+cache_collector.register("sparql", sparql_cache.get_stats)
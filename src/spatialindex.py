@@ -0,0 +1,83 @@
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+
+class SpatialIndex:
+    """
+    STRtree over every feature of a set of GeoJSON layers, built once and
+    queried in bulk for all objects at a time. Features without a geometry
+    are left out.
+    """
+
+    def __init__(self, layers):
+        geometries = []
+        feature_layers = []
+        self.feature_properties = []
+        for layer_index, data in enumerate(layers):
+            for feature in data.get("features", []):
+                if not feature.get("geometry"):
+                    continue
+                geometries.append(shape(feature["geometry"]))
+                feature_layers.append(layer_index)
+                self.feature_properties.append(feature.get("properties") or {})
+        self.properties = {}
+        self.build(np.array(geometries, dtype=object), feature_layers)
+
+    @classmethod
+    def from_frames(cls, frames):
+        # The same index over GeoDataFrames, such as layers from read_layer,
+        # whose geometries are used as they are; their attribute columns
+        # become the feature properties.
+        index = cls.__new__(cls)
+        frames = [frame[~shapely.is_missing(frame.geometry.values)] for frame in frames]
+        columns = dict.fromkeys(column for frame in frames for column in frame.columns if column != "geometry")
+        index.feature_properties = None
+        index.properties = {
+            column: np.concatenate([
+                frame[column].to_numpy(dtype=object) if column in frame else np.full(len(frame), None, dtype=object)
+                for frame in frames
+            ])
+            for column in columns
+        }
+        geometries = np.concatenate([frame.geometry.to_numpy() for frame in frames]) if frames else []
+        index.build(np.asarray(geometries, dtype=object), np.repeat(np.arange(len(frames)), [len(frame) for frame in frames]))
+        return index
+
+    def build(self, geometries, feature_layers):
+        self.geometries = geometries
+        self.feature_layers = np.asarray(feature_layers, dtype=int)
+        self.tree = shapely.STRtree(self.geometries)
+
+    def join_points(self, longitudes, latitudes):
+        # Returns two aligned arrays: the index of each point and of each
+        # feature that contains it. A point inside several features appears
+        # once per feature.
+        points = shapely.points(
+            np.asarray(longitudes, dtype=float),
+            np.asarray(latitudes, dtype=float)
+        )
+        if len(self.geometries) == 0 or len(points) == 0:
+            empty = np.array([], dtype=int)
+            return empty, empty
+        point_index, feature_index = self.tree.query(points, predicate="within")
+        return point_index, feature_index
+
+    def get_property(self, name):
+        # Property values of every indexed feature, aligned with the
+        # feature indices returned by join_points.
+        if name not in self.properties:
+            if self.feature_properties is None:
+                return np.full(len(self.geometries), None, dtype=object)
+            self.properties[name] = np.array(
+                [properties.get(name) for properties in self.feature_properties],
+                dtype=object
+            )
+        return self.properties[name]
+
+    def contains(self, point):
+        return len(self.tree.query(point, predicate="within")) > 0
+
+    def count_points_within(self, longitudes, latitudes):
+        point_index, _ = self.join_points(longitudes, latitudes)
+        return len(np.unique(point_index))
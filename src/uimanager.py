@@ -1,11 +1,7 @@
 from htmltools import a
 from shiny import ui
 from shinywidgets import output_widget
-import tomli
-
-
-with open("config.toml", mode="rb") as fp:
-    config = tomli.load(fp)
+from src.config import config
 
 
 class UIManager:
@@ -18,6 +14,10 @@ class UIManager:
                 ui.page_fluid(
                     ui.layout_sidebar(
                         ui.sidebar(
+                        "Search",
+                        ui.input_text("object_search", None, placeholder="Label, description..."),
+                        ui.input_action_button("object_search_button", "Search"),
+                        ui.output_ui("search_results_list"),
                         "Layers",
                         ui.output_ui("layers"),
                         bg="#f8f8f8",
@@ -26,7 +26,7 @@ class UIManager:
                             output_widget("map"),
                         ),
                         ui.output_ui("value_boxes"),
-                        ui.output_plot("plot"),
+                        ui.output_ui("plot"),
                     ),
                 )
             ),
@@ -0,0 +1,23 @@
+import os
+import sys
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+# config.toml is read relative to the working directory.
+os.chdir(ROOT)
+
+from src.connectionmanager import get_connection_manager
+from src.sparqlcache import SparqlCache
+from src import dbfunctions
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    # A throwaway database, which also holds the SPARQL response cache.
+    path = str(tmp_path / "test.duckdb")
+    monkeypatch.setattr(dbfunctions, "sparql_cache", SparqlCache(db_path=path, mode="online"))
+    yield path
+    get_connection_manager(path).close()
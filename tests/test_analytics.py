@@ -0,0 +1,88 @@
+import geopandas as gpd
+import pandas as pd
+import pytest
+import shapely
+from src import dbfunctions
+from src.analytics import RiskAnalytics
+from src.spatialindex import SpatialIndex
+
+
+@pytest.fixture
+def exposure_data(db_path, tmp_path):
+    # risk1 covers Q1 and Q2, an unnamed zone covers Q2 and Q3, Q4 lies
+    # outside both and Q5 has no coordinates.
+    path = str(tmp_path / "zones.shp")
+    gpd.GeoDataFrame({"name": ["risk1", None, "risk2"]}, geometry=[
+        shapely.box(0, 0, 2, 1), shapely.box(1, 0, 3, 1), None
+    ], crs="EPSG:4326").to_file(path)
+    dbfunctions.add_geodataframe(path, db_path)
+    with dbfunctions.connection(db_path) as conn:
+        conn.execute("""
+            INSERT INTO objects (id, wikidata_id, label, latitude, longitude) VALUES
+            (1, 'Q1', 'One', 0.5, 0.5),
+            (2, 'Q2', 'Two', 0.5, 1.5),
+            (3, 'Q3', 'Three', 0.5, 2.5),
+            (4, 'Q4', 'Four', 5.0, 5.0),
+            (5, 'Q5', 'Five', NULL, NULL)
+        """)
+        dbfunctions.bump_table_version(conn, "objects")
+    dbfunctions.set_risk_scores(pd.DataFrame({
+        "wikidata_id": ["Q1", "Q2", "Q4"],
+        "heading": ["risk1", "risk1", "risk1"],
+        "value": [5, 3, 9],
+    }), db_path)
+    return ["zones"]
+
+
+def test_exposure_counts_unnamed_features(db_path, exposure_data):
+    exposure = RiskAnalytics().get_exposure(exposure_data, db_path)
+    assert sorted(map(tuple, exposure.to_numpy())) == [
+        ("Q1", "risk1"), ("Q2", "risk1"), ("Q2", "zones"), ("Q3", "zones"),
+    ]
+
+
+def test_figures(db_path, exposure_data):
+    analytics = RiskAnalytics()
+    assert analytics.get_highest_risk(exposure_data, db_path).sort_index().to_dict() == {"Q1": 5, "Q2": 3, "Q3": 0}
+    summary = analytics.get_summary(exposure_data, db_path)
+    assert summary["affected"] == 3
+    assert summary["highest_risk"] == {"wikidata_id": "Q1", "label": "One", "total_risk": 5}
+    assert summary["dominant_risk"] == {"heading": "risk1", "name": "Earthquake", "avg_risk_value": 4.0}
+    plot = analytics.get_plot_data(exposure_data, db_path)
+    assert list(plot.itertuples(index=False, name=None)) == [
+        ("One", "Earthquake", 5), ("Two", "Earthquake", 3), ("Two", "zones", 0), ("Three", "zones", 0),
+    ]
+
+
+def test_no_layers(db_path, exposure_data):
+    analytics = RiskAnalytics()
+    assert analytics.get_summary([], db_path) == {"affected": 0, "highest_risk": None, "dominant_risk": None}
+    assert analytics.get_plot_data([], db_path).empty
+    assert analytics.get_highest_risk([], db_path).empty
+
+
+def test_exposure_is_joined_once_per_change(db_path, exposure_data, monkeypatch):
+    joins = []
+    from_frames = SpatialIndex.from_frames.__func__
+
+    def counting(cls, frames):
+        joins.append(len(frames))
+        return from_frames(cls, frames)
+    monkeypatch.setattr(SpatialIndex, "from_frames", classmethod(counting))
+
+    analytics = RiskAnalytics()
+    analytics.get_summary(exposure_data, db_path)
+    analytics.get_plot_data(exposure_data, db_path)
+    analytics.get_highest_risk(exposure_data, db_path)
+    assert len(joins) == 1
+
+    # New scores change the figures but not who is exposed.
+    dbfunctions.set_risk_scores(pd.DataFrame({"wikidata_id": ["Q3"], "heading": ["zones"], "value": [7]}), db_path)
+    assert analytics.get_highest_risk(exposure_data, db_path)["Q3"] == 7
+    assert len(joins) == 1
+
+    with dbfunctions.connection(db_path) as conn:
+        conn.execute("INSERT INTO objects (id, wikidata_id, label, latitude, longitude) VALUES (6, 'Q6', 'Six', 0.5, 0.5)")
+        dbfunctions.bump_table_version(conn, "objects")
+    assert analytics.get_summary(exposure_data, db_path)["affected"] == 4
+    assert len(joins) == 2
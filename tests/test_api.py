@@ -0,0 +1,64 @@
+import pytest
+from starlette.responses import PlainTextResponse
+from starlette.testclient import TestClient
+from sparql_stub import start_stub_server, synthetic_entity
+from src import api, dbfunctions
+from src.metrics import with_metrics
+from src.routing import with_routes
+
+
+async def fallback(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            await send({"type": message["type"] + ".complete"})
+            if message["type"] == "lifespan.shutdown":
+                return
+    await PlainTextResponse(f"app {scope['path']}")(scope, receive, send)
+
+
+@pytest.fixture
+def client(db_path, monkeypatch):
+    server, url = start_stub_server({"Q1": synthetic_entity("Q1"), "Q2": {"label": "Object without a location"}})
+    dbfunctions.add_objects(["Q1", "Q2"], db_path, endpoint_url=url)
+    server.shutdown()
+    monkeypatch.setattr(api, "search_objects", lambda query, limit: dbfunctions.search_objects(query, limit, db_path))
+    with TestClient(with_metrics(api.with_search_api(fallback), "/metrics"), raise_server_exceptions=True) as client:
+        yield client
+
+
+def test_with_routes():
+    async def route(scope, receive, send):
+        await PlainTextResponse("route")(scope, receive, send)
+    client = TestClient(with_routes(fallback, {"/route": route}))
+    assert client.get("/route").text == "route"
+    assert client.get("/route/more").text == "app /route/more"
+    assert client.get("/").text == "app /"
+
+
+def test_search(client):
+    response = client.get("/api/search", params={"q": "object q1"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["query"] == "object q1"
+    assert [result["wikidata_id"] for result in body["results"]] == ["Q1", "Q2"]
+    assert body["results"][0]["latitude"] is not None
+    # Missing coordinates are null rather than NaN.
+    assert body["results"][1]["latitude"] is None
+
+
+def test_search_limit(client):
+    assert len(client.get("/api/search", params={"q": "object", "limit": 1}).json()["results"]) == 1
+    assert len(client.get("/api/search", params={"q": "object", "limit": 0}).json()["results"]) == 1
+
+
+@pytest.mark.parametrize("params", [{}, {"q": " "}, {"q": "object", "limit": "ten"}])
+def test_search_rejects_bad_requests(client, params):
+    response = client.get("/api/search", params=params)
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_other_paths_reach_the_app(client):
+    assert client.get("/metrics").text.startswith("# HELP")
+    assert client.get("/").text == "app /"
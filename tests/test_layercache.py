@@ -0,0 +1,54 @@
+import json
+from src.layercache import LayerCache, PARSED_SIZE_FACTOR
+
+
+def payload(name, size=100):
+    return json.dumps({"type": "FeatureCollection", "features": [], "name": name * size})
+
+
+def test_get_checks_version():
+    cache = LayerCache(max_bytes=10_000)
+    cache.put(("db", "roads"), 1, payload("a"))
+    assert cache.get(("db", "roads"), 1) == payload("a")
+    assert cache.get(("db", "roads"), 2) is None
+    assert cache.get_stats()["hits"] == 1
+    assert cache.get_stats()["misses"] == 1
+
+
+def test_parsed_layers_are_shared():
+    cache = LayerCache(max_bytes=10_000)
+    cache.put(("db", "roads"), 1, payload("a"))
+    assert cache.get(("db", "roads"), 1, parsed=True) is cache.get(("db", "roads"), 1, parsed=True)
+
+
+def test_least_recently_used_layers_are_evicted():
+    size = len(payload("a"))
+    cache = LayerCache(max_bytes=2 * size)
+    cache.put(("db", "a"), 1, payload("a"))
+    cache.put(("db", "b"), 1, payload("b"))
+    cache.get(("db", "a"), 1)
+    cache.put(("db", "c"), 1, payload("c"))
+    assert cache.get(("db", "b"), 1) is None
+    assert cache.get(("db", "a"), 1) == payload("a")
+    assert cache.get_stats()["evictions"] == 1
+    assert cache.get_stats()["bytes"] <= cache.max_bytes
+
+
+def test_layers_over_budget_are_not_kept():
+    size = len(payload("a"))
+    cache = LayerCache(max_bytes=size * PARSED_SIZE_FACTOR)
+    cache.put(("db", "a"), 1, payload("a"))
+    # Parsed, the entry outgrows the budget; it is returned but dropped.
+    assert cache.put(("db", "b"), 1, payload("b"), parsed=True)["name"] == "b" * 100
+    assert cache.get_stats()["entries"] == 0
+    assert cache.get_stats()["bytes"] == 0
+
+
+def test_invalidate_drops_every_level():
+    cache = LayerCache(max_bytes=10_000)
+    cache.put(("db", "roads", "geometry"), 1, payload("a"))
+    cache.put(("db", "roads", "geometry_z8"), 1, payload("b"))
+    cache.put(("db", "rivers", "geometry"), 1, payload("c"))
+    cache.invalidate(("db", "roads"))
+    assert cache.get_stats()["entries"] == 1
+    assert cache.get(("db", "rivers", "geometry"), 1) == payload("c")
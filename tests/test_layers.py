@@ -0,0 +1,188 @@
+import json
+import zipfile
+import geopandas as gpd
+import pytest
+import shapely
+from src import dbfunctions
+from src.layercache import layer_cache
+from src.config import config
+
+
+LONGITUDE, LATITUDE = config["map"]["longitude"], config["map"]["latitude"]
+
+
+@pytest.fixture
+def layer(db_path, tmp_path):
+    # A detailed circle at the map centre, a square smaller than a pixel at
+    # zoom 8 but not at zoom 14, and a square far away, in EPSG:32632 like
+    # the regional data.
+    features = gpd.GeoDataFrame({
+        "name": ["centre", "small", "far"],
+        "code": [1, 2, 3],
+    }, geometry=[
+        shapely.Point(LONGITUDE, LATITUDE).buffer(0.01, quad_segs=64),
+        shapely.box(LONGITUDE + 0.02, LATITUDE, LONGITUDE + 0.0205, LATITUDE + 0.0005),
+        shapely.box(LONGITUDE + 1, LATITUDE + 1, LONGITUDE + 1.01, LATITUDE + 1.01),
+    ], crs="EPSG:4326").to_crs("EPSG:32632")
+    path = str(tmp_path / "test_layer.shp")
+    features.to_file(path)
+    dbfunctions.add_geodataframe(path, db_path)
+    return dbfunctions.layer_name(path)
+
+
+def names(data):
+    return sorted(feature["properties"]["name"] for feature in data["features"])
+
+
+def test_pyramid_level():
+    assert dbfunctions.pyramid_level(None) == "geometry"
+    assert dbfunctions.pyramid_level(5) == "geometry_z8"
+    assert dbfunctions.pyramid_level(8) == "geometry_z8"
+    assert dbfunctions.pyramid_level(9) == "geometry_z11"
+    assert dbfunctions.pyramid_level(14) == "geometry_z14"
+    assert dbfunctions.pyramid_level(15) == "geometry"
+
+
+def test_read_layer_returns_attributes_and_geometry(db_path, layer):
+    gdf = dbfunctions.read_layer(layer, db_path)
+    assert list(gdf.columns) == ["name", "code", "geometry"]
+    assert gdf.crs.to_epsg() == 4326
+    assert gdf.geometry.iloc[0].centroid.distance(shapely.Point(LONGITUDE, LATITUDE)) < 1e-6
+
+    with_bounds = dbfunctions.read_layer(layer, db_path, bounds=True)
+    assert list(with_bounds.columns) == ["name", "code", *dbfunctions.BBOX_COLUMNS, "geometry"]
+    assert with_bounds[dbfunctions.BBOX_COLUMNS].to_numpy() == pytest.approx(gdf.bounds.to_numpy())
+
+
+def test_pyramid_levels_are_simplified(db_path, layer):
+    vertices = {
+        level: int(shapely.get_num_coordinates(dbfunctions.read_layer(layer, db_path, level).geometry).sum())
+        for level in ["geometry_z8", "geometry_z11", "geometry_z14", "geometry"]
+    }
+    assert vertices["geometry_z8"] < vertices["geometry_z11"] < vertices["geometry"]
+    assert vertices["geometry_z14"] <= vertices["geometry"]
+
+    full = dbfunctions.read_layer(layer, db_path)
+    coarse = dbfunctions.read_layer(layer, db_path, "geometry_z8")
+    # Simplified shapes stay within a pixel of the original.
+    tolerance = dbfunctions.simplify_tolerance(8)
+    assert shapely.hausdorff_distance(full.geometry.iloc[0], coarse.geometry.iloc[0]) <= tolerance
+
+
+def test_bbox_selects_intersecting_features(db_path, layer):
+    centre = (LONGITUDE - 0.05, LATITUDE - 0.05, LONGITUDE + 0.05, LATITUDE + 0.05)
+    assert names(dbfunctions.get_geospatial_data(layer, db_path, parsed=True, bbox=centre, zoom=14)) == ["centre", "small"]
+    # Touching only the far edge of the circle's bounds still selects it.
+    edge = (LONGITUDE + 0.0099, LATITUDE - 0.001, LONGITUDE + 0.015, LATITUDE + 0.001)
+    assert names(dbfunctions.get_geospatial_data(layer, db_path, parsed=True, bbox=edge, zoom=14)) == ["centre"]
+    nowhere = (LONGITUDE - 2, LATITUDE - 2, LONGITUDE - 1, LATITUDE - 1)
+    assert names(dbfunctions.get_geospatial_data(layer, db_path, parsed=True, bbox=nowhere, zoom=14)) == []
+
+
+def test_bbox_skips_subpixel_features(db_path, layer):
+    everything = (LONGITUDE - 2, LATITUDE - 2, LONGITUDE + 2, LATITUDE + 2)
+    assert names(dbfunctions.get_geospatial_data(layer, db_path, parsed=True, bbox=everything, zoom=8)) == ["centre", "far"]
+    assert names(dbfunctions.get_geospatial_data(layer, db_path, parsed=True, bbox=everything, zoom=14)) == ["centre", "far", "small"]
+    assert names(dbfunctions.get_geospatial_data(layer, db_path, parsed=True, bbox=everything)) == ["centre", "far", "small"]
+
+
+@pytest.mark.parametrize("zoom", [15, None])
+def test_bbox_reads_full_resolution_from_table(db_path, layer, zoom):
+    centre = (LONGITUDE - 0.05, LATITUDE - 0.05, LONGITUDE + 0.05, LATITUDE + 0.05)
+    data = dbfunctions.get_geospatial_data(layer, db_path, parsed=True, bbox=centre, zoom=zoom)
+    assert names(data) == ["centre", "small"]
+    full = dbfunctions.read_layer(layer, db_path)
+    assert len(data["features"][0]["geometry"]["coordinates"][0]) == shapely.get_num_coordinates(full.geometry.iloc[0])
+    # Only the viewport was read; the whole layer was not cached.
+    assert layer_cache.get((db_path, layer, "geometry"), dbfunctions.get_layer_version(layer, db_path), with_bounds=True) is None
+
+
+def test_bbox_reads_large_layers_from_table(db_path, layer, monkeypatch):
+    monkeypatch.setitem(dbfunctions.config["cache"], "shared_layer_max_mb", 0)
+    centre = (LONGITUDE - 0.05, LATITUDE - 0.05, LONGITUDE + 0.05, LATITUDE + 0.05)
+    assert names(dbfunctions.get_geospatial_data(layer, db_path, parsed=True, bbox=centre, zoom=8)) == ["centre"]
+    assert layer_cache.get((db_path, layer, "geometry_z8"), dbfunctions.get_layer_version(layer, db_path), with_bounds=True) is None
+    assert json.loads(dbfunctions.get_geospatial_data(layer, db_path, bbox=centre, zoom=14)) == \
+        dbfunctions.get_geospatial_data(layer, db_path, parsed=True, bbox=centre, zoom=14)
+
+
+def test_bbox_serves_cached_level_features(db_path, layer):
+    everything = (LONGITUDE - 2, LATITUDE - 2, LONGITUDE + 2, LATITUDE + 2)
+    whole = dbfunctions.get_geospatial_data(layer, db_path, parsed=True, zoom=11)
+    view = dbfunctions.get_geospatial_data(layer, db_path, parsed=True, bbox=everything, zoom=11)
+    assert all(any(feature is cached for cached in whole["features"]) for feature in view["features"])
+    assert json.loads(dbfunctions.get_geospatial_data(layer, db_path, bbox=everything, zoom=11)) == view
+
+
+def test_bbox_follows_new_uploads(db_path, layer, tmp_path):
+    centre = (LONGITUDE - 0.05, LATITUDE - 0.05, LONGITUDE + 0.05, LATITUDE + 0.05)
+    assert len(dbfunctions.get_geospatial_data(layer, db_path, parsed=True, bbox=centre, zoom=14)["features"]) == 2
+    path = str(tmp_path / f"{layer}.shp")
+    gpd.GeoDataFrame({"name": ["moved"], "code": [4]}, geometry=[
+        shapely.box(LONGITUDE, LATITUDE, LONGITUDE + 0.01, LATITUDE + 0.01)
+    ], crs="EPSG:4326").to_file(path)
+    dbfunctions.add_geodataframe(path, db_path)
+    assert names(dbfunctions.get_geospatial_data(layer, db_path, parsed=True, bbox=centre, zoom=14)) == ["moved"]
+
+
+def write_square(path):
+    gpd.GeoDataFrame({"name": ["square"], "code": [1]}, geometry=[
+        shapely.box(LONGITUDE, LATITUDE, LONGITUDE + 0.01, LATITUDE + 0.01)
+    ], crs="EPSG:4326").to_file(path)
+
+
+def test_upload_cannot_replace_app_tables(db_path, tmp_path):
+    with dbfunctions.connection(db_path) as conn:
+        conn.execute("CREATE TABLE users (username VARCHAR, password_hash VARCHAR)")
+        conn.execute("INSERT INTO users VALUES ('admin', 'hash')")
+    path = str(tmp_path / "users.shp")
+    write_square(path)
+    with pytest.raises(ValueError, match="reserved"):
+        dbfunctions.add_geodataframe(path, db_path)
+
+    archive = str(tmp_path / "upload.zip")
+    with zipfile.ZipFile(archive, "w") as zf:
+        for suffix in ["shp", "shx", "dbf", "prj"]:
+            zf.write(str(tmp_path / f"users.{suffix}"), f"Users.{suffix}")
+    report = dbfunctions.add_archive(archive, db_path)
+    assert "reserved" in report["Users"]["error"]
+
+    with dbfunctions.connection(db_path, read_only=True) as conn:
+        assert conn.execute("SELECT * FROM users").fetchall() == [("admin", "hash")]
+    assert dbfunctions.get_table_names(db_path) == []
+
+
+def test_upload_cannot_replace_other_tables(db_path, tmp_path):
+    with dbfunctions.connection(db_path) as conn:
+        conn.execute("CREATE TABLE notes (text VARCHAR)")
+    path = str(tmp_path / "notes.shp")
+    write_square(path)
+    with pytest.raises(ValueError, match="not a layer"):
+        dbfunctions.add_geodataframe(path, db_path)
+    with dbfunctions.connection(db_path, read_only=True) as conn:
+        assert [row[0] for row in conn.execute("DESCRIBE notes").fetchall()] == ["text"]
+
+
+def test_features_without_geometry(db_path, tmp_path):
+    path = str(tmp_path / "gaps.shp")
+    gpd.GeoDataFrame({"name": ["square", "missing"], "code": [1, 2]}, geometry=[
+        shapely.box(LONGITUDE, LATITUDE, LONGITUDE + 0.01, LATITUDE + 0.01), None
+    ], crs="EPSG:4326").to_file(path)
+    report = dbfunctions.add_geodataframe(path, db_path)
+    assert report["geometry"]["vertices"] == 5
+
+    layer = dbfunctions.get_geospatial_data("gaps", db_path, parsed=True)
+    assert [feature["geometry"] is None for feature in layer["features"]] == [False, True]
+    everything = (LONGITUDE - 2, LATITUDE - 2, LONGITUDE + 2, LATITUDE + 2)
+    # Missing geometries have NaN bounds and never fall inside a viewport.
+    assert names(dbfunctions.get_geospatial_data("gaps", db_path, parsed=True, bbox=everything, zoom=14)) == ["square"]
+    assert names(dbfunctions.get_geospatial_data("gaps", db_path, parsed=True, bbox=everything, zoom=15)) == ["square"]
+
+
+def test_migrate_layers_without_geometry(db_path):
+    with dbfunctions.connection(db_path) as conn:
+        conn.execute("CREATE TABLE legacy (name VARCHAR, geometry VARCHAR)")
+        conn.execute("INSERT INTO legacy VALUES ('square', 'POLYGON ((0 0, 100 0, 100 100, 0 100, 0 0))'), ('missing', NULL)")
+    assert dbfunctions.migrate_layers(db_path) == ["legacy"]
+    gdf = dbfunctions.read_layer("legacy", db_path)
+    assert list(gdf.geometry.isna()) == [False, True]
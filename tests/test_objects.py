@@ -0,0 +1,52 @@
+import pytest
+from sparql_stub import start_stub_server, synthetic_entity
+from src import dbfunctions
+from src.config import config
+
+
+@pytest.fixture
+def endpoint():
+    entities = {entity_id: synthetic_entity(entity_id) for entity_id in ["Q1", "Q2", "Q3"]}
+    server, url = start_stub_server(entities)
+    yield server, url
+    server.shutdown()
+
+
+def test_add_objects_batches_queries(db_path, endpoint):
+    server, url = endpoint
+    report = dbfunctions.add_objects(["Q1", "q2", "Q3", "Q1"], db_path, endpoint_url=url)
+    assert report == {"Q1": "Added", "Q2": "Added", "Q3": "Added"}
+    assert server.RequestHandlerClass.requests == 1
+
+    objects = dbfunctions.get_objects(db_path)
+    assert sorted(objects["wikidata_id"]) == ["Q1", "Q2", "Q3"]
+    assert set(objects["label"]) == {"Object Q1", "Object Q2", "Object Q3"}
+
+
+def test_add_objects_reports_every_id(db_path, endpoint):
+    server, url = endpoint
+    dbfunctions.add_objects(["Q1"], db_path, endpoint_url=url)
+    report = dbfunctions.add_objects(["Q1", "Q2", "Q99", "nope"], db_path, endpoint_url=url)
+    assert report == {
+        "Q1": "Already present",
+        "Q2": "Added",
+        "Q99": "Not found or missing label",
+        "NOPE": "Invalid Wikidata ID",
+    }
+
+
+def test_add_objects_uses_cached_responses(db_path, endpoint):
+    server, url = endpoint
+    dbfunctions.add_objects(["Q1", "Q2"], db_path, endpoint_url=url)
+    with dbfunctions.connection(db_path) as conn:
+        conn.execute("DELETE FROM objects")
+    dbfunctions.add_objects(["Q1", "Q2"], db_path, endpoint_url=url)
+    assert server.RequestHandlerClass.requests == 1
+    assert len(dbfunctions.get_objects(db_path)) == 2
+
+
+def test_add_objects_survives_endpoint_failure(db_path, monkeypatch):
+    monkeypatch.setitem(config["entity"]["ingest"], "retries", 0)
+    report = dbfunctions.add_objects(["Q1"], db_path, endpoint_url="http://127.0.0.1:9/sparql")
+    assert report["Q1"].startswith("Query failed")
+    assert dbfunctions.get_objects(db_path).empty
@@ -0,0 +1,95 @@
+import math
+import pytest
+from src import dbfunctions
+
+
+# Duplicate and missing sort keys, so ties fall back to id and NULLs sort
+# as '' or -infinity.
+ROWS = [
+    (1, "Q1", "Basilica", 44.42),
+    (2, "Q2", None, 44.41),
+    (3, "Q3", "Mausoleo", None),
+    (4, "Q4", "Basilica", 44.40),
+    (5, "Q5", "Arena", 44.42),
+    (6, "Q6", None, None),
+    (7, "Q7", "Zodiaco", 44.43),
+    (8, "Q8", "", 44.39),
+    (9, "Q9", "basilica", 44.42),
+    (10, "Q10", "Mausoleo", 44.40),
+    (11, "Q11", "Arena", None),
+]
+
+
+@pytest.fixture
+def objects_db(db_path):
+    with dbfunctions.connection(db_path) as conn:
+        conn.executemany("INSERT INTO objects (id, wikidata_id, label, latitude) VALUES (?, ?, ?, ?)", ROWS)
+    return db_path
+
+
+def expected_order(sort_by, descending=False, rows=ROWS):
+    column = {"id": 0, "wikidata_id": 1, "label": 2, "latitude": 3}[sort_by]
+    missing = -math.inf if sort_by == "latitude" else ""
+    ordered = sorted(rows, key=lambda row: (missing if row[column] is None else row[column], row[0]), reverse=descending)
+    return [row[0] for row in ordered]
+
+
+def walk(db_path, sort_by, descending, limit, filters=None):
+    # Pages forwards to the end and back again; returns the ids seen each
+    # way and checks the previous/next flags on the way.
+    forward = []
+    page = dbfunctions.get_objects_page(sort_by, descending, filters, limit=limit, db_path=db_path)
+    pages = [page]
+    assert not page["has_previous"]
+    while page["has_next"]:
+        page = dbfunctions.get_objects_page(sort_by, descending, filters, after=page["last"], limit=limit, db_path=db_path)
+        assert page["has_previous"]
+        pages.append(page)
+    for page in pages:
+        forward.extend(page["data"]["id"])
+
+    backward = list(page["data"]["id"])
+    while page["has_previous"]:
+        page = dbfunctions.get_objects_page(sort_by, descending, filters, before=page["first"], limit=limit, db_path=db_path)
+        assert page["has_next"]
+        backward = list(page["data"]["id"]) + backward
+    assert len(page["data"]) == min(limit, len(forward))
+    return forward, backward, pages
+
+
+@pytest.mark.parametrize("sort_by", ["id", "wikidata_id", "label", "latitude"])
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("limit", [1, 3, 4, 11, 20])
+def test_walk_forwards_and_backwards(objects_db, sort_by, descending, limit):
+    forward, backward, pages = walk(objects_db, sort_by, descending, limit)
+    assert forward == expected_order(sort_by, descending)
+    assert backward == forward
+    assert len(pages) == max(1, math.ceil(len(ROWS) / limit))
+    assert all(page["total"] == len(ROWS) for page in pages)
+
+
+def test_cursor_keys_coalesce_missing_values(objects_db):
+    page = dbfunctions.get_objects_page("latitude", limit=2, db_path=objects_db)
+    assert page["first"] == (-math.inf, 3)
+    assert list(page["data"]["id"]) == [3, 6]
+    assert page["data"]["latitude"].isna().all()
+    page = dbfunctions.get_objects_page("label", limit=3, db_path=objects_db)
+    assert page["last"] == ("", 8)
+
+
+def test_filters_with_paging(objects_db):
+    filters = {"label": "BASIL"}
+    forward, backward, pages = walk(objects_db, "label", False, 2, filters)
+    assert forward == backward == expected_order("label", rows=[row for row in ROWS if row[2] and "basil" in row[2].lower()])
+    assert all(page["total"] == 3 for page in pages)
+    empty = dbfunctions.get_objects_page("label", filters={"label": "nothing"}, db_path=objects_db)
+    assert empty["data"].empty
+    assert empty["total"] == 0
+    assert empty["first"] is None and not empty["has_next"]
+
+
+def test_unknown_columns_are_rejected(objects_db):
+    with pytest.raises(ValueError):
+        dbfunctions.get_objects_page("password_hash", db_path=objects_db)
+    with pytest.raises(ValueError):
+        dbfunctions.get_objects_page(filters={"1; DROP TABLE objects": "x"}, db_path=objects_db)
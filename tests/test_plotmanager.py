@@ -0,0 +1,41 @@
+import pandas as pd
+from src.plotmanager import PlotManager
+
+
+def plot_data(value):
+    return pd.DataFrame({
+        "name": ["San Vitale", "San Vitale", "Galla Placidia"],
+        "risk": ["Flood", "Landslide", "Flood"],
+        "value": [value, 2, 3],
+    })
+
+
+def test_create_plot_renders_png():
+    image = PlotManager().create_plot(plot_data(1))
+    assert image.startswith(b"\x89PNG")
+
+
+def test_create_plot_counts_hits_and_misses():
+    plots = PlotManager(max_entries=4)
+    first = plots.create_plot(plot_data(1))
+    assert plots.create_plot(plot_data(1)) is first
+    plots.create_plot(plot_data(2))
+    assert plots.get_stats() == {"hits": 1, "misses": 2, "evictions": 0, "entries": 2}
+
+
+def test_create_plot_evicts_least_recently_used():
+    plots = PlotManager(max_entries=2)
+    plots.create_plot(plot_data(1))
+    plots.create_plot(plot_data(2))
+    plots.create_plot(plot_data(1))
+    plots.create_plot(plot_data(3))
+    assert plots.get_stats() == {"hits": 1, "misses": 3, "evictions": 1, "entries": 2}
+    # plot_data(2) was the least recently used and is drawn again.
+    plots.create_plot(plot_data(2))
+    plots.create_plot(plot_data(3))
+    assert plots.get_stats() == {"hits": 2, "misses": 4, "evictions": 2, "entries": 2}
+
+
+def test_empty_data_renders():
+    plots = PlotManager()
+    assert plots.create_plot(plot_data(1).iloc[:0]).startswith(b"\x89PNG")
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+from src.mapmanager import render_popups, POPUP_TEMPLATE
+from src.config import config
+
+
+FIELDS = [field for _, field, _, _ in POPUP_TEMPLATE if field is not None]
+
+
+def objects_frame():
+    return pd.DataFrame({
+        "id": [1, 2],
+        "wikidata_id": ["Q1", "Q2"],
+        "label": ["Basilica di San Vitale", "Mausoleo di Galla Placidia"],
+        "alt_label": ["San Vitale", None],
+        "description": ["church in Ravenna", None],
+        "latitude": [44.4204, 44.4210],
+        "longitude": [12.1966, np.nan],
+        "date": ["0547-01-01", None],
+        "property": ["Ministero della cultura", None],
+        "official_site": ["https://example.org/q1", None],
+        "viaf": ["123456", None],
+    })
+
+
+def test_render_popups_matches_format():
+    data = objects_frame()
+    popups = render_popups(data)
+    assert len(popups) == 2
+    row = data.iloc[0]
+    assert popups[0] == config["map"]["popup_content"].format(**{field: row[field] for field in FIELDS})
+
+
+def test_render_popups_leaves_missing_values_empty():
+    popups = render_popups(objects_frame())
+    assert "Mausoleo di Galla Placidia (Q2)" in popups[1]
+    assert "44.421, </dd>" in popups[1]
+    assert "nan" not in popups[1].lower()
+    assert "None" not in popups[1]
+
+
+def test_render_popups_empty_frame():
+    assert len(render_popups(objects_frame().iloc[:0])) == 0
@@ -0,0 +1,158 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+import pytest
+from sparql_stub import start_stub_server
+from src import dbfunctions
+from src.config import config
+
+
+ENTITIES = {
+    "Q1": {"label": "Basilica di San Vitale", "description": "Church with Byzantine mosaics", "latitude": "44.4204", "longitude": "12.1966"},
+    "Q2": {"label": "Mausoleo di Galla Placidia", "description": "Mausoleum with mosaics", "latitude": "44.4210", "longitude": "12.1970"},
+    "Q3": {"label": "Basilica di Sant'Apollinare Nuovo", "description": "Basilica church in Ravenna", "latitude": "44.4165", "longitude": "12.2046"},
+    "Q4": {"label": "Battistero Neoniano", "description": "Baptistery in Ravenna", "latitude": "44.4160", "longitude": "12.1950"},
+    "Q5": {"label": "Mosaico perduto", "description": "Lost mosaic, location unknown"},
+}
+
+
+@pytest.fixture
+def search_db(db_path):
+    server, url = start_stub_server(ENTITIES)
+    dbfunctions.add_objects(list(ENTITIES), db_path, endpoint_url=url)
+    yield db_path, url
+    server.shutdown()
+
+
+def terms(text):
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode()
+    return [term for term in re.split(r"[^a-z0-9]+", text) if term]
+
+
+def reference_scores(query, entities):
+    # BM25 with the last query word also matched as a prefix, computed
+    # independently of the index.
+    settings = config["search"]
+    documents = {
+        entity_id: terms(" ".join(entity.get(column) or "" for column in dbfunctions.SEARCH_COLUMNS))
+        for entity_id, entity in entities.items()
+    }
+    average = sum(map(len, documents.values())) / len(documents)
+    words = terms(query)
+    exact = set(words[:-1]) - {words[-1]}
+    scores = Counter()
+    for term in {term for document in documents.values() for term in document}:
+        if term in exact or term == words[-1]:
+            weight = 1.0
+        elif term.startswith(words[-1]):
+            weight = settings["prefix_weight"]
+        else:
+            continue
+        matching = {entity_id: Counter(document)[term] for entity_id, document in documents.items() if term in document}
+        idf = math.log(1 + (len(documents) - len(matching) + 0.5) / (len(matching) + 0.5))
+        for entity_id, frequency in matching.items():
+            length = len(documents[entity_id])
+            scores[entity_id] += weight * idf * frequency * (settings["k1"] + 1) / (
+                frequency + settings["k1"] * (1 - settings["b"] + settings["b"] * length / average)
+            )
+    return scores
+
+
+@pytest.mark.parametrize("query", ["basilica", "ravenna church", "mosaic", "Basilica Ravenna", "mos"])
+def test_bm25_ranking(search_db, query):
+    db_path, _ = search_db
+    result = dbfunctions.search_objects(query, db_path=db_path)
+    expected = reference_scores(query, ENTITIES)
+    assert list(result.columns) == dbfunctions.SEARCH_RESULT_COLUMNS
+    assert dict(zip(result["wikidata_id"], result["score"])) == pytest.approx(dict(expected))
+    assert list(result["score"]) == sorted(result["score"], reverse=True)
+
+
+def test_rarer_terms_rank_higher(search_db):
+    db_path, _ = search_db
+    # "byzantine" is in one document, "church" in two.
+    result = dbfunctions.search_objects("church byzantine", db_path=db_path)
+    assert list(result["wikidata_id"]) == ["Q1", "Q3"]
+
+
+def test_last_word_matches_as_prefix(search_db):
+    db_path, _ = search_db
+    assert set(dbfunctions.search_objects("mosai", db_path=db_path)["wikidata_id"]) == {"Q1", "Q2", "Q5"}
+    # Only the last word is a prefix; "mosai" here must match exactly.
+    assert list(dbfunctions.search_objects("mosai baptistery", db_path=db_path)["wikidata_id"]) == ["Q4"]
+    # An exact match outweighs one reached only as a prefix.
+    assert dbfunctions.search_objects("mosaic", db_path=db_path)["wikidata_id"].iloc[0] == "Q5"
+
+
+def test_accents_and_case_are_ignored(search_db):
+    db_path, _ = search_db
+    assert list(dbfunctions.search_objects("SANT'APOLLINARE", db_path=db_path)["wikidata_id"]) == ["Q3"]
+    assert list(dbfunctions.search_objects("Neoniàno", db_path=db_path)["wikidata_id"]) == ["Q4"]
+
+
+def test_limit_and_empty_queries(search_db):
+    db_path, _ = search_db
+    assert len(dbfunctions.search_objects("ravenna mosaics", limit=2, db_path=db_path)) == 2
+    assert dbfunctions.search_objects("---", db_path=db_path).empty
+    assert dbfunctions.search_objects("nowhere", db_path=db_path).empty
+
+
+def test_missing_coordinates(search_db):
+    db_path, _ = search_db
+    result = dbfunctions.search_objects("perduto", db_path=db_path)
+    assert list(result["wikidata_id"]) == ["Q5"]
+    assert result[["latitude", "longitude"]].isna().all(axis=None)
+
+
+def test_objects_are_indexed_on_insert(search_db):
+    db_path, url = search_db
+    assert dbfunctions.search_objects("Arian", db_path=db_path).empty
+    server, url = start_stub_server({"Q6": {"label": "Battistero degli Ariani", "description": "Arian baptistery"}})
+    dbfunctions.add_objects(["Q6"], db_path, endpoint_url=url)
+    server.shutdown()
+    assert list(dbfunctions.search_objects("Arian", db_path=db_path)["wikidata_id"]) == ["Q6"]
+    # An index kept up to date on insert is not rebuilt at startup.
+    assert dbfunctions.build_search_index(db_path) is False
+
+
+def test_compaction_sorts_postings(search_db, monkeypatch):
+    db_path, _ = search_db
+    with dbfunctions.connection(db_path, read_only=True) as conn:
+        total = conn.execute("SELECT COUNT(*) FROM object_terms").fetchone()[0]
+        assert conn.execute("SELECT sorted_postings FROM search_index").fetchone()[0] == total
+        postings = conn.execute("SELECT term, object_id FROM object_terms").fetchall()
+    assert postings == sorted(postings)
+    assert dbfunctions.compact_search_index(db_path) is False
+
+    # Postings added under the threshold are searchable but left unsorted.
+    monkeypatch.setitem(config["search"], "compact_ratio", 10)
+    server, url = start_stub_server({"Q6": {"label": "Aardvark", "description": "Aardvark"}})
+    dbfunctions.add_objects(["Q6"], db_path, endpoint_url=url)
+    server.shutdown()
+    with dbfunctions.connection(db_path, read_only=True) as conn:
+        assert conn.execute("SELECT sorted_postings FROM search_index").fetchone()[0] == total
+    assert list(dbfunctions.search_objects("aardvark", db_path=db_path)["wikidata_id"]) == ["Q6"]
+
+    monkeypatch.setitem(config["search"], "compact_ratio", 0)
+    assert dbfunctions.compact_search_index(db_path) is True
+    with dbfunctions.connection(db_path, read_only=True) as conn:
+        postings = conn.execute("SELECT term, object_id FROM object_terms").fetchall()
+        assert conn.execute("SELECT sorted_postings FROM search_index").fetchone()[0] == len(postings)
+    assert postings == sorted(postings)
+
+
+def test_deleted_objects(search_db):
+    db_path, _ = search_db
+    with dbfunctions.connection(db_path) as conn:
+        conn.execute("DELETE FROM objects WHERE wikidata_id IN ('Q1', 'Q3')")
+    # Postings of deleted objects are skipped until the index is pruned.
+    assert set(dbfunctions.search_objects("basilica mosaic", db_path=db_path)["wikidata_id"]) == {"Q2", "Q5"}
+
+    assert dbfunctions.build_search_index(db_path) is True
+    with dbfunctions.connection(db_path, read_only=True) as conn:
+        assert conn.execute("SELECT COUNT(DISTINCT object_id) FROM object_terms").fetchone()[0] == 3
+        assert conn.execute("SELECT documents FROM search_index").fetchone()[0] == 3
+    remaining = {entity_id: ENTITIES[entity_id] for entity_id in ["Q2", "Q4", "Q5"]}
+    result = dbfunctions.search_objects("ravenna mosaics", db_path=db_path)
+    assert dict(zip(result["wikidata_id"], result["score"])) == pytest.approx(dict(reference_scores("ravenna mosaics", remaining)))
@@ -0,0 +1,141 @@
+import threading
+import pytest
+from sparql_stub import start_stub_server, synthetic_entity
+from src import dbfunctions, sparqlcache
+from src.sparqlcache import SparqlCache, SparqlCacheMiss
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sparqlcache, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def endpoint():
+    server, url = start_stub_server({f"Q{i}": synthetic_entity(f"Q{i}") for i in range(1, 4)})
+    yield server, url
+    server.shutdown()
+
+
+def requests(server):
+    return server.RequestHandlerClass.requests
+
+
+def lookup(cache, url, *entity_ids):
+    query = dbfunctions.build_values_query(list(entity_ids))
+    return cache.get(query, url, lambda: dbfunctions.fetch_sparql_bindings(query, url))
+
+
+def test_hits_within_ttl(db_path, endpoint, clock):
+    server, url = endpoint
+    cache = SparqlCache(db_path=db_path, ttl=3600, mode="online")
+    first = lookup(cache, url, "Q1", "Q2")
+    clock.now += 3599
+    assert lookup(cache, url, "Q1", "Q2") == first
+    assert requests(server) == 1
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+    clock.now += 2
+    assert lookup(cache, url, "Q1", "Q2") == first
+    assert requests(server) == 2
+
+
+def test_keys_ignore_whitespace_but_not_endpoints():
+    assert SparqlCache.make_key("SELECT  *\n{ ?s ?p ?o }", "a") == SparqlCache.make_key("SELECT * { ?s ?p ?o }", "a")
+    assert SparqlCache.make_key("SELECT * { ?s ?p ?o }", "a") != SparqlCache.make_key("SELECT * { ?s ?p ?o }", "b")
+
+
+def test_empty_results_expire_sooner(db_path, endpoint, clock):
+    server, url = endpoint
+    cache = SparqlCache(db_path=db_path, ttl=3600, negative_ttl=60, mode="online")
+    assert lookup(cache, url, "Q99") == []
+    lookup(cache, url, "Q1")
+    clock.now += 61
+    lookup(cache, url, "Q99")
+    lookup(cache, url, "Q1")
+    assert requests(server) == 3
+
+
+def test_eviction_follows_deferred_access_times(db_path, endpoint, clock):
+    server, url = endpoint
+    cache = SparqlCache(db_path=db_path, ttl=3600, max_entries=2, mode="online")
+    lookup(cache, url, "Q1")
+    clock.now += 1
+    lookup(cache, url, "Q2")
+    clock.now += 1
+    # A hit only reads the table; its access time is written by the next
+    # store, in time to keep Q1 over the older Q2.
+    lookup(cache, url, "Q1")
+    with dbfunctions.connection(db_path, read_only=True) as conn:
+        assert conn.execute("SELECT COUNT(DISTINCT accessed_at) FROM sparql_cache").fetchone()[0] == 2
+    clock.now += 1
+    lookup(cache, url, "Q3")
+    assert cache.get_stats()["evictions"] == 1
+    assert requests(server) == 3
+
+    lookup(cache, url, "Q1")
+    assert requests(server) == 3
+    lookup(cache, url, "Q2")
+    assert requests(server) == 4
+
+
+def test_offline_serves_only_the_cache(db_path, endpoint, clock):
+    server, url = endpoint
+    online = SparqlCache(db_path=db_path, ttl=60, mode="online")
+    cached = lookup(online, url, "Q1")
+    offline = SparqlCache(db_path=db_path, ttl=60, mode="offline")
+    clock.now += 3600
+    assert lookup(offline, url, "Q1") == cached
+    with pytest.raises(SparqlCacheMiss):
+        lookup(offline, url, "Q2")
+    assert requests(server) == 1
+    assert offline.get_stats()["misses"] == 1
+
+
+def test_offline_imports(db_path, endpoint, monkeypatch):
+    # Tests and demos can import objects from a recorded cache with no
+    # endpoint at all.
+    server, url = endpoint
+    dbfunctions.add_objects(["Q1", "Q2"], db_path, endpoint_url=url)
+    with dbfunctions.connection(db_path) as conn:
+        conn.execute("DELETE FROM objects")
+    monkeypatch.setattr(dbfunctions.sparql_cache, "mode", "offline")
+    server.shutdown()
+    assert dbfunctions.add_objects(["Q1", "Q2"], db_path, endpoint_url=url) == {"Q1": "Added", "Q2": "Added"}
+    assert dbfunctions.add_objects(["Q3"], db_path, endpoint_url=url)["Q3"].startswith("Query failed")
+
+
+def test_stale_while_revalidate_refreshes_once(db_path, clock):
+    server, url = start_stub_server(delay=0.3)
+    try:
+        cache = SparqlCache(db_path=db_path, ttl=60, mode="stale-while-revalidate")
+        stale = lookup(cache, url, "Q1")
+        clock.now += 61
+        threads = [threading.Thread(target=lambda: lookup(cache, url, "Q1")) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Every caller got the stale answer without waiting for the refresh.
+        assert cache.get_stats()["stale"] == 5
+        for _ in range(50):
+            if cache.get_stats()["refreshes"]:
+                break
+            threading.Event().wait(0.1)
+        assert cache.get_stats()["refreshes"] == 1
+        assert requests(server) == 2
+        assert lookup(cache, url, "Q1") == stale
+        assert cache.get_stats()["hits"] == 1
+    finally:
+        server.shutdown()
@@ -0,0 +1,103 @@
+"""
+Minimal SPARQL endpoint for running entity imports offline.
+
+It answers any query with one binding per `wd:Q...` entity mentioned in it,
+taken from a fixture file or generated around the configured map centre:
+
+    python tools/sparql_stub.py --port 8999 --fixtures entities.json
+
+Point [entity] endpoint_url (or the endpoint_url argument of add_objects)
+at http://localhost:8999/sparql.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+ENTITY = re.compile(r"wd:(Q[0-9]+)")
+
+
+def synthetic_entity(entity_id, latitude=44.4183598, longitude=12.2035294, spread=0.05):
+    rng = random.Random(entity_id)
+    return {
+        "label": f"Object {entity_id}",
+        "alt_label": f"Oggetto {entity_id}",
+        "description": f"Synthetic heritage object {entity_id}",
+        "latitude": str(latitude + rng.uniform(-spread, spread)),
+        "longitude": str(longitude + rng.uniform(-spread, spread)),
+        "date": f"{rng.randint(400, 1900):04d}-01-01T00:00:00Z",
+        "official_site": f"https://example.org/{entity_id}",
+        "viaf": str(rng.randint(100000, 999999)),
+        "property": "Synthetic owner",
+    }
+
+
+def to_binding(entity_id, entity):
+    binding = {"entity": {"type": "uri", "value": f"http://www.wikidata.org/entity/{entity_id}"}}
+    for key, value in entity.items():
+        binding[key] = {"type": "literal", "value": value}
+    return binding
+
+
+class SparqlStubHandler(BaseHTTPRequestHandler):
+    entities = None
+    delay = 0.0
+    requests = 0
+
+    def do_GET(self):
+        self.answer(parse_qs(urlparse(self.path).query).get("query", [""])[0])
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        if self.headers.get("Content-Type", "").startswith("application/sparql-query"):
+            self.answer(body)
+        else:
+            self.answer(parse_qs(body).get("query", [""])[0])
+
+    def answer(self, query):
+        type(self).requests += 1
+        if self.delay:
+            threading.Event().wait(self.delay)
+        bindings = []
+        for entity_id in dict.fromkeys(ENTITY.findall(query)):
+            if self.entities is None:
+                bindings.append(to_binding(entity_id, synthetic_entity(entity_id)))
+            elif entity_id in self.entities:
+                bindings.append(to_binding(entity_id, self.entities[entity_id]))
+        payload = json.dumps({"head": {"vars": []}, "results": {"bindings": bindings}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/sparql-results+json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(entities=None, port=0, delay=0.0):
+    # entities maps QIDs to field dicts; None answers every QID with
+    # synthetic data. Returns the running server and its endpoint URL.
+    handler = type("Handler", (SparqlStubHandler,), {"entities": entities, "delay": delay, "requests": 0})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/sparql"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--fixtures", help="JSON file mapping QIDs to entity fields")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before each answer")
+    args = parser.parse_args()
+    entities = None
+    if args.fixtures:
+        with open(args.fixtures) as fp:
+            entities = json.load(fp)
+    server, url = start_stub_server(entities, args.port, args.delay)
+    print(f"SPARQL stub listening on {url}")
+    threading.Event().wait()